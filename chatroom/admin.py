@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Message, Contact, FriendRequest, Session
+from .models import Message, MessageArchiveSegment, Contact, FriendRequest, ReadWatermark, Session
 
 # Register your models here.
 
@@ -7,3 +7,5 @@ admin.site.register(Message)
 admin.site.register(Contact)
 admin.site.register(FriendRequest)
 admin.site.register(Session)
+admin.site.register(MessageArchiveSegment)
+admin.site.register(ReadWatermark)
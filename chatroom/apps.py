@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ChatroomConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatroom'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_save
+        from .cache import invalidate_public_key
+        from .metrics import install_query_counter
+        connection_created.connect(install_query_counter)
+        post_save.connect(invalidate_public_key, sender='authentication.Profile')
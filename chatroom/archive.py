@@ -0,0 +1,91 @@
+import zlib
+from datetime import datetime
+from django.conf import settings
+from django.db import transaction
+from . import codec, frames
+
+"""
+Message archival tier.
+
+`manage.py archive_messages` moves the oldest messages of each session into MessageArchiveSegment
+rows: up to SEGMENT_SIZE messages serialized as one zlib-compressed JSON array. Only a session's
+oldest run of read messages older than AFTER_DAYS is archived, so archived ids are always below every
+id still in chatroom_message for that session; history reads page through the hot table first and
+continue into the segments once it runs out. Each segment is written and its rows deleted in one
+short transaction.
+"""
+
+FIELDS = ('id', 'sender_id', 'receiver_id', 'content', 'nonce', 'timestamp')
+
+
+def options():
+    options = getattr(settings, 'CHAT_ARCHIVE', {})
+    return {
+        'AFTER_DAYS': options.get('AFTER_DAYS', 180),
+        'SEGMENT_SIZE': options.get('SEGMENT_SIZE', 500),
+        'COMPRESSION_LEVEL': options.get('COMPRESSION_LEVEL', 6),
+    }
+
+
+# Serialize message rows (oldest first) into a compressed segment payload
+def pack(rows):
+    payload = [[row[field].isoformat() if field == 'timestamp' else row[field] for field in FIELDS] for row in rows]
+    return zlib.compress(codec.dumps(payload).encode(), options()['COMPRESSION_LEVEL'])
+
+
+# Deserialize a segment payload into message rows (oldest first)
+def unpack(data):
+    rows = []
+    for values in codec.loads(zlib.decompress(bytes(data))):
+        row = dict(zip(FIELDS, values))
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+        rows.append(row)
+    return rows
+
+
+# Archive the oldest run of old, read messages of a session as one segment; returns how many moved
+def archive_session(session_pk, cutoff, segment_size):
+    from .models import Message, MessageArchiveSegment, ReadWatermark
+    with transaction.atomic():
+        read_up_to = dict(
+            ReadWatermark.objects.filter(session_id=session_pk).values_list('user_id', 'last_read_message_id')
+        )
+        rows = Message.objects.filter(session_id=session_pk).order_by('id').values(
+            *FIELDS, 'content_bytes', 'nonce_bytes'
+        )[:segment_size]
+        batch = []
+        for row in rows:
+            # Stop at the first message that must stay hot, keeping the archive a prefix of the session
+            if row['timestamp'] >= cutoff or row['id'] > read_up_to.get(row['receiver_id'], 0):
+                break
+            # Segments store ciphertext as base64 text whichever protocol it arrived over
+            row['content'], row['nonce'] = frames.row_text(row)
+            batch.append(row)
+        if not batch:
+            return 0
+        MessageArchiveSegment.objects.create(
+            session_id=session_pk,
+            first_message_id=batch[0]['id'],
+            last_message_id=batch[-1]['id'],
+            message_count=len(batch),
+            data=pack(batch),
+        )
+        Message.objects.filter(session_id=session_pk, id__lte=batch[-1]['id']).delete()
+    return len(batch)
+
+
+# Read up to `limit` archived messages of a session with id < before (None: from the newest), newest first
+def read_archived(session_pk, before, limit):
+    from .models import MessageArchiveSegment
+    segments = MessageArchiveSegment.objects.filter(session_id=session_pk)
+    if before:
+        segments = segments.filter(first_message_id__lt=before)
+    rows = []
+    for data in segments.order_by('-last_message_id').values_list('data', flat=True).iterator(chunk_size=4):
+        for row in reversed(unpack(data)):
+            if before and row['id'] >= before:
+                continue
+            rows.append(row)
+            if len(rows) >= limit:
+                return rows
+    return rows
@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from . import codec
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+"""
+Two-tier cache: a per-process LRU in front of a shared Redis tier.
+
+Local entries live for LOCAL_TTL seconds so other worker processes pick up an invalidation within
+that window; Redis entries live for REDIS_TTL seconds. Values must be JSON-serializable; a loader
+returning None (nothing to cache yet) is not cached. If Redis is unavailable the cache degrades to the
+local tier plus the loader.
+"""
+
+
+class TwoTierCache:
+    def __init__(self, name, setting_name):
+        self.name = name
+        self.setting_name = setting_name
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _options(self):
+        options = getattr(settings, self.setting_name, {})
+        return {
+            'MAX_ENTRIES': options.get('MAX_ENTRIES', 10000),
+            'LOCAL_TTL': options.get('LOCAL_TTL', 30),
+            'REDIS_TTL': options.get('REDIS_TTL', 3600),
+        }
+
+    def _redis_key(self, key):
+        return f"cache:{self.name}:{key}"
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value):
+        options = self._options()
+        with self._lock:
+            self._local[key] = (time.monotonic() + options['LOCAL_TTL'], value)
+            self._local.move_to_end(key)
+            while len(self._local) > options['MAX_ENTRIES']:
+                self._local.popitem(last=False)
+
+    def _drop_local(self, keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    # Get a value from the cache, calling the async loader on a miss in both tiers
+    async def aget(self, key, loader):
+        key = str(key)
+        value = self._get_local(key)
+        if value is not None:
+            return value
+        try:
+            raw = await get_redis().get(self._redis_key(key))
+        except Exception as e:
+            logger.warning("%s cache read failed: %s", self.name, e)
+            raw = None
+        if raw is not None:
+            value = codec.loads(raw)
+        else:
+            value = await loader()
+            if value is None:
+                return None
+            try:
+                await get_redis().set(self._redis_key(key), codec.dumps(value), ex=self._options()['REDIS_TTL'])
+            except Exception as e:
+                logger.warning("%s cache write failed: %s", self.name, e)
+        self._set_local(key, value)
+        return value
+
+    # Get a value from the cache from sync code (views), calling the loader on a miss
+    def get(self, key, loader):
+        key = str(key)
+        value = self._get_local(key)
+        if value is not None:
+            return value
+        try:
+            raw = get_sync_redis().get(self._redis_key(key))
+        except Exception as e:
+            logger.warning("%s cache read failed: %s", self.name, e)
+            raw = None
+        if raw is not None:
+            value = codec.loads(raw)
+        else:
+            value = loader()
+            if value is None:
+                return None
+            self.set(key, value, local=False)
+        self._set_local(key, value)
+        return value
+
+    # Populate both tiers from sync code
+    def set(self, key, value, local=True):
+        key = str(key)
+        try:
+            get_sync_redis().set(self._redis_key(key), codec.dumps(value), ex=self._options()['REDIS_TTL'])
+        except Exception as e:
+            logger.warning("%s cache write failed: %s", self.name, e)
+        if local:
+            self._set_local(key, value)
+
+    # Drop entries from both tiers from sync code
+    def invalidate(self, *keys):
+        keys = [str(key) for key in keys]
+        self._drop_local(keys)
+        try:
+            get_sync_redis().delete(*(self._redis_key(key) for key in keys))
+        except Exception as e:
+            logger.warning("%s cache invalidation failed: %s", self.name, e)
+
+    # Drop entries from both tiers from async code
+    async def ainvalidate(self, *keys):
+        keys = [str(key) for key in keys]
+        self._drop_local(keys)
+        try:
+            await get_redis().delete(*(self._redis_key(key) for key in keys))
+        except Exception as e:
+            logger.warning("%s cache invalidation failed: %s", self.name, e)
+
+
+# Contact ids per user id, invalidated when a friend request is accepted
+contact_cache = TwoTierCache('contacts', 'CONTACT_CACHE')
+
+# Session id and both encrypted AES keys per participant pair (see session_pair_key), populated when a
+# friend request is accepted; sessions never change after creation. Public keys are not stored here:
+# they can change, so they are always read through public_key_cache
+session_key_cache = TwoTierCache('session_keys', 'SESSION_CACHE')
+
+# Public key per username; keys are set at registration, so entries are only dropped when a profile
+# is saved (which also covers a username being registered again after its user was deleted)
+public_key_cache = TwoTierCache('public_keys', 'SESSION_CACHE')
+
+
+# Cache key of a conversation, the same whichever participant asks
+def session_pair_key(username_a, username_b):
+    return ':'.join(sorted([username_a, username_b]))
+
+
+# post_save receiver for Profile (connected in ChatroomConfig.ready)
+def invalidate_public_key(sender, instance, **kwargs):
+    public_key_cache.invalidate(instance.user.username)
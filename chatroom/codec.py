@@ -0,0 +1,58 @@
+import json
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:     # optional, stdlib json is used instead
+    orjson = None
+
+"""
+JSON codec for websocket frames and Redis payloads.
+
+Uses orjson when it is installed (several times faster than the stdlib for the small dicts sent
+over websockets) and falls back to the json module otherwise. CHAT_JSON_CODEC selects 'auto'
+(default), 'orjson' or 'json'. dumps() always returns str, ready for send(text_data=...), and the
+output of both backends is compact and interchangeable.
+"""
+
+_backend = None
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+BACKENDS = {'json': (_stdlib_dumps, json.loads)}
+if orjson is not None:
+    BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+
+# Resolve the configured backend once per process
+def _get_backend():
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'CHAT_JSON_CODEC', 'auto')
+        if name == 'auto':
+            name = 'orjson' if orjson is not None else 'json'
+        if name not in BACKENDS:
+            raise ValueError(f"CHAT_JSON_CODEC {name!r} is not available (installed: {', '.join(BACKENDS)})")
+        _backend = BACKENDS[name]
+    return _backend
+
+
+def backend_name():
+    return 'orjson' if _get_backend() is BACKENDS.get('orjson') else 'json'
+
+
+# Serialize an object to a JSON str
+def dumps(obj):
+    return _get_backend()[0](obj)
+
+
+# Parse JSON from str or bytes
+def loads(data):
+    return _get_backend()[1](data)
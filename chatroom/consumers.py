@@ -1,18 +1,52 @@
-import json
+import asyncio
+import logging
+from urllib.parse import parse_qs
+from channels.db import aclose_old_connections
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-import redis.asyncio as redis
+from . import codec, flowcontrol, frames, metrics, presence, unread
+from .cache import contact_cache
+from .persistence import get_message_writer, write_behind_enabled
 
-# Redis-based online user tracking
-REDIS_URL = 'redis://127.0.0.1:6379/0'
-ONLINE_USERS_KEY = 'online_users'
+logger = logging.getLogger(__name__)
+
+# Number of presence group_sends issued concurrently during a fan-out
+FANOUT_CHUNK_SIZE = 100
+
+# Keeps references to fire-and-forget tasks so they are not garbage collected mid-flight
+_background_tasks = set()
+
+
+# Run a coroutine off the connection's critical path
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# Notification coalescing options (see NOTIFICATION_COALESCING in settings)
+def coalescing_options():
+    options = getattr(settings, 'NOTIFICATION_COALESCING', {})
+    return options.get('WINDOW_MS', 0) / 1000, options.get('MAX_EVENTS', 100)
+
+
+# Most messages replayed to a reconnecting chat socket (see CHAT_RESUME in settings)
+def max_replay():
+    return getattr(settings, 'CHAT_RESUME', {}).get('MAX_REPLAY', 200)
 
 """
 self.scope (in connect method) (type: dict) -> purpose: Holds metadata about the current connection, similar to request in standard Django views.
 
-@database_sync_to_async -> purpose: Decorator to run database operations in a thread-safe manner, allowing async code to interact with Django ORM.
+Pre-serialized frames -> purpose: Broadcast events carry the finished frame under 'frame', encoded once by the sender (codec.py); the handlers on every receiving connection forward it as-is instead of re-encoding it per recipient.
+Coalescing -> purpose: With NOTIFICATION_COALESCING['WINDOW_MS'] set, NotificationConsumer buffers notification frames for that long and sends them as one {"type": "batch", "events": [...]} frame; frames with the same 'key' (unread count per sender, presence per user) replace each other so only the latest state goes out.
+Resume -> purpose: A chat socket opened with ?last_id=<id> is sent every message of the session after that id (an index range on (session, id)) before any live frame, followed by a resume_complete frame; chat_message frames carry the message id so clients can track their cursor and drop duplicates. With write-behind the id arrives later, in message_ack (sender) or message_committed (everyone else in the room).
+Flow control -> purpose: ChatConsumer drops frames beyond its per-socket and per-user token buckets, answering rate_limited with the frame's nonce, and closes sockets that keep flooding (see flowcontrol.py and CHAT_FLOW_CONTROL).
+Binary subprotocol -> purpose: Chat sockets that negotiate frames.SUBPROTOCOL send and receive chat messages as binary frames with raw ciphertext/nonce bytes; a broadcast carries one frame in the sender's protocol, and connections of the other protocol rebuild it, so JSON and binary clients can share a room.
+ORM access -> purpose: Consumers use Django's async ORM API (asave, acount, aupdate, afirst, async for) directly instead of wrapping sync ORM code in database_sync_to_async.
+aclose_old_connections() -> purpose: Recycles expired/broken DB connections; called once per connect and on every presence heartbeat rather than around every query.
 """
 
 
@@ -24,98 +58,198 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         if self.user.is_anonymous:
             await self.close()
             return
+        await aclose_old_connections()
         self.group_name = f"notifications_{self.user_id}"
+        self.pending_frames = {}
+        self.flush_task = None
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.add_online_user(self.user_id)
+        went_online = await self.add_online_user(self.user_id, self.channel_name)
         await self.accept()
         await self.send_online_contacts()
-        await self.notify_contacts_online_status(True)
+        # Contacts are told about us after our own first frame has gone out, and only if this
+        # is our first live connection (other tabs already announced us otherwise)
+        if went_online:
+            run_in_background(self.notify_contacts_online_status(True))
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        if metrics.enabled():
+            metrics.active_connections.inc(consumer='notifications')
 
     async def disconnect(self, close_code):
-        await self.remove_online_user(self.user_id)
+        if self.user.is_anonymous:
+            return
+        if metrics.enabled():
+            metrics.active_connections.dec(consumer='notifications')
+        self.heartbeat_task.cancel()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        went_offline = await self.remove_online_user(self.user_id, self.channel_name)
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
-        await self.notify_contacts_online_status(False)
+        if went_offline:
+            run_in_background(self.notify_contacts_online_status(False))
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
+        if metrics.enabled():
+            metrics.frames_received.inc(consumer='notifications')
+        data = codec.loads(text_data)
         if data.get("type") == "mark_read":
             await self.mark_messages_read(data.get("contact_id"))
 
-    # Redis connection
-    @staticmethod
-    async def get_redis():
-        return await redis.from_url(REDIS_URL, decode_responses=True)
-
     # Send online contacts to the user
     async def send_online_contacts(self):
-        contacts = await self.get_contacts()
-        online_contacts = []
-        for contact_id in contacts:
-            if await self.is_user_online(contact_id):
-                online_contacts.append(contact_id)
-        await self.send(text_data=json.dumps({
+        online_contacts = await self.get_online_users(await self.get_contacts())
+        await self.send(text_data=codec.dumps({
             "type": "online_contacts",
             "user_ids": online_contacts
         }))
 
-    # Add user to online users list
-    @classmethod
-    async def add_online_user(cls, user_id):
-        redis = await cls.get_redis()
-        await redis.sadd(ONLINE_USERS_KEY, user_id)
-        await redis.close()
+    # Register this connection; returns True if the user just came online
+    @staticmethod
+    @metrics.timed('presence_connect')
+    async def add_online_user(user_id, channel_name):
+        return await presence.connect(user_id, channel_name)
 
-    # Remove user from online users list
-    @classmethod
-    async def remove_online_user(cls, user_id):
-        redis = await cls.get_redis()
-        await redis.srem(ONLINE_USERS_KEY, user_id)
-        await redis.close()
+    # Unregister this connection; returns True if it was the user's last one
+    @staticmethod
+    @metrics.timed('presence_disconnect')
+    async def remove_online_user(user_id, channel_name):
+        return await presence.disconnect(user_id, channel_name)
 
     # Check if a user is online
+    @staticmethod
+    async def is_user_online(user_id):
+        return await presence.is_online(user_id)
+
+    # Check which of the given users are online in a single round trip
+    @staticmethod
+    @metrics.timed('presence_online_users')
+    async def get_online_users(user_ids):
+        return await presence.online_users(user_ids)
+
+    # Keep this connection's presence alive and sweep ghosts left by crashed workers
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(presence.heartbeat_interval())
+            try:
+                await aclose_old_connections()
+                if await presence.refresh(self.user_id, self.channel_name):
+                    run_in_background(self.notify_contacts_online_status(True))
+                for user_id in await presence.sweep():
+                    contacts = await self.get_contacts_of(user_id)
+                    run_in_background(self.broadcast_online_status(self.channel_layer, user_id, contacts, False))
+            except Exception as e:
+                logger.warning("Presence heartbeat for user %s failed: %s", self.user_id, e)
+
+    # Get list of contact ids for the connected user
+    async def get_contacts(self):
+        return await self.get_contacts_of(self.user_id)
+
+    # Get list of contact ids for any user (cached, see cache.py)
     @classmethod
-    async def is_user_online(cls, user_id):
-        redis = await cls.get_redis()
-        is_online = await redis.sismember(ONLINE_USERS_KEY, user_id)
-        await redis.close()
-        return is_online
-
-    # Get list of online contacts
-    @database_sync_to_async
-    def get_contacts(self):
+    async def get_contacts_of(cls, user_id):
+        return await contact_cache.aget(user_id, lambda: cls.load_contacts(user_id))
+
+    # Load list of contact ids from the database
+    @staticmethod
+    async def load_contacts(user_id):
         from .models import Contact
-        return [str(c.contact_user.id) for c in Contact.objects.filter(user=self.user)]
+        return [str(c) async for c in Contact.objects.filter(user_id=user_id).values_list('contact_user_id', flat=True)]
 
-    # Mark messages as read for a specific contact
-    @database_sync_to_async
-    def mark_messages_read(self, contact_id):
-        from .models import Message
-        return Message.objects.filter(sender_id=contact_id, receiver_id=self.user.id, is_read=False).update(is_read=True)
+    # Mark messages as read for a specific contact and clear their unread counter
+    @metrics.timed('mark_messages_read')
+    async def mark_messages_read(self, contact_id):
+        if not contact_id:
+            return None
+        watermark = await self.update_messages_read(contact_id)
+        await unread.reset(self.user_id, contact_id)
+        return watermark
+
+    # Move this user's read watermark of the conversation up to its newest message; returns the new
+    # watermark, or None if there is no conversation with that contact
+    async def update_messages_read(self, contact_id):
+        from django.db.models import OuterRef, Q, Subquery
+        from .models import Message, Session
+        newest = Message.objects.filter(session_id=OuterRef('pk')).order_by('-id').values('id')[:1]
+        session = await Session.objects.filter(
+            Q(sender_id=self.user_id, receiver_id=contact_id) |
+            Q(sender_id=contact_id, receiver_id=self.user_id)
+        ).order_by('id').annotate(newest_id=Subquery(newest)).values_list('id', 'newest_id').afirst()
+        if session is None or session[1] is None:
+            return None
+        await unread.set_watermark(self.user_id, *session)
+        return session[1]
 
-    # Send notification to the user
+    # Send notification to the user (forwards the pre-serialized frame)
     async def send_notification(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        await self.queue_frame(event.get("key"), event["frame"])
 
-    # Send online status to contacts
+    # Send online status to contacts (forwards the pre-serialized frame)
     async def send_online_status(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        await self.queue_frame(event.get("key"), event["frame"])
+
+    # Send a frame now, or buffer it for the coalescing window; a buffered frame with the same key is replaced
+    async def queue_frame(self, key, frame):
+        window, max_events = coalescing_options()
+        if not window:
+            await self.send(text_data=frame)
+            return
+        if key is None:
+            key = object()      # never merged with another frame
+        elif key in self.pending_frames:
+            del self.pending_frames[key]    # keep arrival order of the latest state
+            if metrics.enabled():
+                metrics.frames_coalesced.inc()
+        self.pending_frames[key] = frame
+        if len(self.pending_frames) >= max_events:
+            await self.flush_frames()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_frames(window))
 
-    # Notify contacts about the user's online status
+    # Send every buffered frame, batched into one frame when there is more than one
+    async def flush_frames(self, delay=0):
+        if delay:
+            await asyncio.sleep(delay)
+        elif self.flush_task is not None:
+            self.flush_task.cancel()
+        frames = list(self.pending_frames.values())
+        self.pending_frames = {}
+        self.flush_task = None
+        if len(frames) == 1:
+            await self.send(text_data=frames[0])
+        elif frames:
+            # The frames are already JSON, so the batch is assembled without re-encoding them
+            await self.send(text_data='{"type":"batch","events":[' + ','.join(frames) + ']}')
+
+    # Notify contacts about the user's online status (the current contact list, so contacts
+    # added while this socket was open are told too; cached, see cache.py)
     async def notify_contacts_online_status(self, is_online):
         contacts = await self.get_contacts()
-        for contact_id in contacts:
-            group = f"notifications_{contact_id}"
-            await self.channel_layer.group_send(
-                group,
-                {
-                    "type": "send_online_status",   # This will call the send_online_status method
-                    "data": {
-                        "type": "online_status",
-                        "user_id": self.user_id,
-                        "is_online": is_online,
-                    },
-                },
+        await self.broadcast_online_status(self.channel_layer, self.user_id, contacts, is_online)
+
+    # Send a user's online status to all of their contacts
+    @staticmethod
+    @metrics.timed('presence_fanout')
+    async def broadcast_online_status(channel_layer, user_id, contact_ids, is_online):
+        # Encoded once, no matter how many contacts receive it
+        event = {
+            "type": "send_online_status",   # This will call the send_online_status method
+            "key": f"online_status:{user_id}",
+            "frame": codec.dumps({
+                "type": "online_status",
+                "user_id": user_id,
+                "is_online": is_online,
+            }),
+        }
+        groups = [f"notifications_{contact_id}" for contact_id in contact_ids]
+        # Issue the group_sends concurrently so they share pooled connections instead of
+        # paying one round trip per contact
+        for i in range(0, len(groups), FANOUT_CHUNK_SIZE):
+            results = await asyncio.gather(
+                *(channel_layer.group_send(group, event) for group in groups[i:i + FANOUT_CHUNK_SIZE]),
+                return_exceptions=True,
             )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.warning("Presence fan-out for user %s failed: %s", user_id, result)
 
     # Notify unread message count to the receiver
     @staticmethod
@@ -127,11 +261,12 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             group,
             {
                 "type": "send_notification",   # This will call the send_notification method
-                "data": {
+                "key": f"unread_message:{sender_id}",
+                "frame": codec.dumps({
                     "type": "unread_message",
                     "from_user": sender_id,
                     "unread_count": unread_count,
-                },
+                }),
             },
         )
 
@@ -142,67 +277,241 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.user = self.scope["user"]
         self.user_id = str(getattr(self.user, 'id', None) or getattr(self.user, 'username', 'anonymous'))
         self.contact_id = self.scope['url_route']['kwargs']['contact_id']
+        self.rate_limiter = None
+        self.closing = False    # set once the server closes the socket; later frames are dropped
         if self.user.is_anonymous:
             await self.close()
             return
+        await aclose_old_connections()
+        # Resolve the chat session once per connection; only its two participants may join
+        session = await self.get_session(self.user_id, self.contact_id)
+        if session is None:
+            await self.close()
+            return
+        self.session_pk, self.session_name = session
         ids = sorted([self.user_id, self.contact_id])
         self.room_group_name = f"chat_{ids[0]}_{ids[1]}"
+        # Binary frames only when the client offers the subprotocol; everyone else keeps JSON
+        self.binary = frames.enabled() and frames.SUBPROTOCOL in self.scope.get('subprotocols', [])
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept(subprotocol=frames.SUBPROTOCOL if self.binary else None)
+        if metrics.enabled():
+            metrics.active_connections.inc(consumer='chat')
+        # Live frames queue up behind connect(), so the replay always goes out first
+        last_id = self.get_resume_cursor()
+        if last_id is not None:
+            await self.replay_messages(last_id)
+        options = flowcontrol.options()
+        if options['ENABLED']:
+            self.rate_limiter = flowcontrol.RateLimiter(self.user_id, options)
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_group_name'):
+            return
+        if metrics.enabled():
+            metrics.active_connections.dec(consumer='chat')
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        session_name = data.get('sessionName')
-        message = data.get('message')
-        nonce = data.get('nonce')
+    async def receive(self, text_data=None, bytes_data=None):
+        if self.closing:
+            return
+        if metrics.enabled():
+            metrics.frames_received.inc(consumer='chat')
+        if bytes_data is not None:
+            # Binary subprotocol: raw ciphertext and nonce bytes
+            try:
+                _, nonce, message = frames.decode(bytes_data)
+            except ValueError as e:
+                logger.warning("Dropping malformed binary frame from user %s: %s", self.user_id, e)
+                return
+        else:
+            data = codec.loads(text_data)
+            message = data.get('message')
+            nonce = data.get('nonce')
+        if self.rate_limiter is not None:
+            retry_after = await self.rate_limiter.check()
+            if retry_after:
+                await self.reject_frame(nonce, retry_after)
+                return
+        session_name = self.session_name
         sender_id = self.user_id
         receiver_id = self.contact_id
-        saved_message = await self.save_message(sender_id, receiver_id, message, nonce, session_name)
-        local_time = timezone.localtime(saved_message.timestamp)
-        formatted_timestamp = local_time.strftime('%I:%M %p')
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',  # This will call the chat_message method
-                'message': message,
-                'sender_id': sender_id,
-                'nonce': nonce,
-                'session_name': session_name,
-                'timestamp': formatted_timestamp
-            }
-        )
-        unread_count = await self.get_unread_count(sender_id, receiver_id)
+        write_behind = write_behind_enabled()
+        if write_behind:
+            message_id = None   # known once the batch commits (see message_committed)
+            timestamp = timezone.now()
+        else:
+            saved_message = await self.save_message(sender_id, receiver_id, message, nonce)
+            message_id = saved_message.pk
+            timestamp = saved_message.timestamp
+            # Counted before the broadcast: a mark_read the receiver sends on seeing it must clear it
+            unread_count = await self.count_unread(sender_id, receiver_id)
+        formatted_timestamp = self.format_timestamp(timestamp)
+
+        # Serialized once here, in this connection's protocol; connections of the same protocol forward it
+        # as-is, the others rebuild it (see chat_message), so the ciphertext travels once per broadcast
+        frame = self.encode_chat_frame({
+            'type': 'chat_message',
+            'id': message_id,
+            'sender_id': sender_id,
+            'session_name': session_name,
+            'timestamp': formatted_timestamp
+        }, message, nonce)
+        with metrics.timer('chat_group_send'):
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'chat_message',  # This will call the chat_message method
+                    'frame': frame,
+                }
+            )
+        if write_behind:
+            # Persisted in the background; the writer counts it as unread once it commits
+            await get_message_writer().enqueue(
+                self.build_message(sender_id, receiver_id, message, nonce), self.room_group_name, self.channel_name,
+            )
+            return
         await NotificationConsumer.notify_unread_message(receiver_id, sender_id, unread_count)
 
-    # Get unread message count for a specific sender and receiver
-    @database_sync_to_async
-    def get_unread_count(self, sender_id, receiver_id):
+    # Tell the client a frame was dropped by the rate limiter; close the socket if it keeps flooding
+    async def reject_frame(self, nonce, retry_after):
+        if self.rate_limiter.exhausted():
+            logger.warning("Closing chat socket of user %s: %d rate-limited frames in a row", self.user_id, self.rate_limiter.rejected)
+            self.closing = True     # drop whatever is still queued behind the close
+            await self.close(code=flowcontrol.CLOSE_RATE_LIMITED)
+            return
+        await self.send(text_data=codec.dumps({
+            'type': 'rate_limited',
+            'nonce': frames.to_text(nonce),
+            'retry_after_ms': retry_after,
+        }))
+
+    # Count a committed message as unread; returns the receiver's new count for this sender
+    @metrics.timed('count_unread')
+    async def count_unread(self, sender_id, receiver_id):
+        try:
+            return await unread.increment(receiver_id, sender_id)
+        except Exception as e:
+            logger.warning("Unread counter update failed, counting from the database: %s", e)
+            return await self.get_unread_count(sender_id, receiver_id)
+
+    # A write-behind message of this room committed (or failed): the sender's connection gets a
+    # message_ack, every other connection a message_committed with its id (the writer counts it as unread)
+    async def message_committed(self, event):
+        is_sender = event['reply_channel'] == self.channel_name
+        await self.send(text_data=codec.dumps({
+            'type': 'message_ack' if is_sender else 'message_committed',
+            'success': event['success'],
+            'id': event['id'],
+            'nonce': event['nonce'],
+        }))
+
+    # Get unread message count for a specific sender and receiver (fallback when Redis is unavailable)
+    @metrics.timed('unread_count_query')
+    async def get_unread_count(self, sender_id, receiver_id):
+        return await unread.unread_in_session(receiver_id, self.session_pk, sender_id).acount()
+
+    # Parse the ?last_id=<message id> resume cursor of the connection, if any
+    def get_resume_cursor(self):
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get('last_id')
+        try:
+            last_id = int(values[0]) if values else None
+        except ValueError:
+            return None
+        return last_id if last_id is not None and last_id >= 0 else None
+
+    # Send the messages this session received after last_id, oldest first
+    @metrics.timed('chat_replay')
+    async def replay_messages(self, last_id):
         from .models import Message
-        return Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id, is_read=False).count()
+        limit = max_replay()
+        rows = [
+            row async for row in Message.objects.filter(session_id=self.session_pk, id__gt=last_id)
+            .order_by('id').values('id', 'sender_id', 'content', 'nonce', 'content_bytes', 'nonce_bytes', 'timestamp')[:limit + 1]
+        ]
+        for row in rows[:limit]:
+            message, nonce = (row['content_bytes'], row['nonce_bytes']) if row['content_bytes'] is not None else (row['content'], row['nonce'])
+            await self.send_chat_frame(self.encode_chat_frame({
+                'type': 'chat_message',
+                'id': row['id'],
+                'sender_id': str(row['sender_id']),
+                'session_name': self.session_name,
+                'timestamp': self.format_timestamp(row['timestamp']),
+                'replayed': True,
+            }, message, nonce))
+        # has_more: the gap is larger than MAX_REPLAY and the client should reload the history instead
+        await self.send(text_data=codec.dumps({
+            'type': 'resume_complete',
+            'replayed': len(rows[:limit]),
+            'has_more': len(rows) > limit,
+        }))
+
+    @staticmethod
+    def format_timestamp(timestamp):
+        return timezone.localtime(timestamp).strftime('%I:%M %p')
+
+    # Build a chat_message frame in this connection's protocol from ciphertext/nonce given as bytes or
+    # base64 text; binary clients get JSON if they are not valid base64
+    def encode_chat_frame(self, header, message, nonce):
+        if self.binary:
+            message_bytes, nonce_bytes = frames.to_bytes(message), frames.to_bytes(nonce)
+            if message_bytes is not None and nonce_bytes is not None and len(nonce_bytes) <= 255:
+                return frames.encode(header, nonce_bytes, message_bytes)
+        return codec.dumps({**header, 'message': frames.to_text(message), 'nonce': frames.to_text(nonce)})
+
+    # Send a chat frame as a binary or text websocket frame, whichever it is
+    async def send_chat_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
 
-    # Send chat message to the group
+    # Send chat message to the group (forwards the pre-serialized frame)
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'sender_id': event['sender_id'],
-            'nonce': event.get('nonce'),
-            'session_name': event.get('session_name'),
-            'timestamp': event.get('timestamp')
-        }))
+        frame = event['frame']
+        if isinstance(frame, bytes) != self.binary:
+            # Sent by a client of the other protocol (a mixed room): rebuild it in this connection's protocol
+            if isinstance(frame, bytes):
+                header, nonce, message = frames.decode(frame)
+            else:
+                header = codec.loads(frame)
+                message, nonce = header.pop('message'), header.pop('nonce')
+            frame = self.encode_chat_frame(header, message, nonce)
+        await self.send_chat_frame(frame)
 
-    # Save message to the database
-    @database_sync_to_async
-    def save_message(self, sender_id, receiver_id, message, nonce, session_name):
-        from django.contrib.auth import get_user_model
-        from .models import Message, Session
-        User = get_user_model()
-        sender = User.objects.get(id=sender_id)
-        receiver = User.objects.get(id=receiver_id)
-        session = Session.objects.get(session_id=session_name)
-        message_obj = Message.objects.create(sender=sender, receiver=receiver, content=message, nonce=nonce, session=session)
+    # Get (pk, session_id) of the chat session between two users, or None if they are not contacts
+    async def get_session(self, user_id, contact_id):
+        from django.db.models import Q
+        from .models import Session
+        return await Session.objects.filter(
+            Q(sender_id=user_id, receiver_id=contact_id) |
+            Q(sender_id=contact_id, receiver_id=user_id)
+        ).order_by('id').values_list('id', 'session_id').afirst()
+
+    # Build an unsaved message for this connection's session (bytes from binary frames go to the binary columns)
+    def build_message(self, sender_id, receiver_id, message, nonce):
+        from .models import Message
+        if isinstance(message, bytes):
+            return Message(
+                session_id=self.session_pk,
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                content='',
+                nonce='',
+                content_bytes=message,
+                nonce_bytes=nonce,
+            )
+        return Message(
+            session_id=self.session_pk,
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            content=message,
+            nonce=nonce,
+        )
+
+    # Save message to the database (a single INSERT by foreign-key ids)
+    @metrics.timed('save_message')
+    async def save_message(self, sender_id, receiver_id, message, nonce):
+        message_obj = self.build_message(sender_id, receiver_id, message, nonce)
+        await message_obj.asave(force_insert=True)
         return message_obj
\ No newline at end of file
@@ -0,0 +1,110 @@
+import logging
+import time
+from django.conf import settings
+from . import metrics
+from .redis_client import get_redis_for
+
+logger = logging.getLogger(__name__)
+
+"""
+Per-connection flow control for chat sockets.
+
+Inbound: every chat frame takes a token from the socket's own bucket (in-process) and from the
+user's bucket ratelimit:<user_id> (a Redis hash on the user's shard, shared by all of the user's
+sockets on every worker). Frames without a token are dropped before they reach the database or
+the channel layer; a socket that keeps sending DISCONNECT_AFTER rejected frames in a row is closed.
+If Redis is unavailable only the per-socket limit applies.
+
+There is no outbound limit: under daphne, send() hands the frame to the transport without waiting
+for the client, so a slow reader cannot be detected from the consumer.
+"""
+
+USER_KEY_PREFIX = 'ratelimit:'
+
+# Close code sent to flooding clients (4000-4999 are reserved for applications)
+CLOSE_RATE_LIMITED = 4029
+
+
+def options():
+    options = getattr(settings, 'CHAT_FLOW_CONTROL', {})
+    return {
+        'ENABLED': options.get('ENABLED', True),
+        'SOCKET_RATE': options.get('SOCKET_RATE', 5),
+        'SOCKET_BURST': options.get('SOCKET_BURST', 20),
+        'USER_RATE': options.get('USER_RATE', 10),
+        'USER_BURST': options.get('USER_BURST', 40),
+        'DISCONNECT_AFTER': options.get('DISCONNECT_AFTER', 100),
+    }
+
+
+# Token bucket refilled at `rate` tokens per second up to `burst` tokens
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # Take one token; returns 0 if allowed, else the milliseconds until a token is available
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return int((1 - self.tokens) / self.rate * 1000) + 1
+
+
+# Take one token from a user's shared bucket; returns 0 if allowed, else the milliseconds to wait
+_CONSUME_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.floor((1 - tokens) / rate * 1000) + 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return wait
+"""
+
+
+async def consume_user_token(user_id, rate, burst):
+    return await get_redis_for(user_id).eval(
+        _CONSUME_SCRIPT, 1, USER_KEY_PREFIX + user_id, rate, burst, time.time(),
+    )
+
+
+# Inbound limits of one chat socket
+class RateLimiter:
+    def __init__(self, user_id, options):
+        self.user_id = user_id
+        self.options = options
+        self.socket_bucket = TokenBucket(options['SOCKET_RATE'], options['SOCKET_BURST'])
+        self.rejected = 0
+
+    # Returns 0 if the frame may be processed, else the milliseconds until the client may send again
+    async def check(self):
+        wait = self.socket_bucket.consume()
+        if not wait and self.options['USER_RATE']:
+            try:
+                wait = await consume_user_token(self.user_id, self.options['USER_RATE'], self.options['USER_BURST'])
+            except Exception as e:
+                logger.warning("Per-user rate limit unavailable, applying the socket limit only: %s", e)
+        self.rejected = self.rejected + 1 if wait else 0
+        if wait and metrics.enabled():
+            metrics.frames_rate_limited.inc(consumer='chat')
+        return wait
+
+    # Too many rejected frames in a row: the client ignores rate_limited frames
+    def exhausted(self):
+        return self.rejected >= self.options['DISCONNECT_AFTER']
+
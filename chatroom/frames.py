@@ -0,0 +1,74 @@
+import base64
+import binascii
+import struct
+from django.conf import settings
+from . import codec
+
+"""
+Binary websocket subprotocol for chat sockets.
+
+A client that offers the SUBPROTOCOL subprotocol on ws/chat/ (and a server with
+CHAT_BINARY_PROTOCOL['ENABLED']) exchanges chat messages as binary frames carrying raw ciphertext
+and nonce bytes instead of base64 inside JSON:
+
+    u32 header length | header (UTF-8 JSON) | u8 nonce length | nonce | ciphertext (rest of frame)
+
+The header holds the small metadata of the frame (type, id, sender_id, ...). Control frames
+(message_ack, resume_complete) stay JSON text. Messages received as binary are stored in
+Message.content_bytes/nonce_bytes; JSON clients and history reads see them base64-encoded, so both
+kinds of client can share a conversation.
+"""
+
+SUBPROTOCOL = 'cindox.binary.v1'
+
+_HEADER_LENGTH = struct.Struct('>I')
+
+
+def enabled():
+    return getattr(settings, 'CHAT_BINARY_PROTOCOL', {}).get('ENABLED', True)
+
+
+# Build a binary frame from a metadata header and raw nonce/ciphertext bytes
+def encode(header, nonce, ciphertext):
+    header = codec.dumps(header).encode()
+    return b''.join((_HEADER_LENGTH.pack(len(header)), header, bytes((len(nonce),)), nonce, ciphertext))
+
+
+# Split a binary frame into (header, nonce, ciphertext); raises ValueError if it is malformed
+def decode(frame):
+    if len(frame) < _HEADER_LENGTH.size + 1:
+        raise ValueError('Frame too short')
+    (header_length,) = _HEADER_LENGTH.unpack_from(frame)
+    offset = _HEADER_LENGTH.size + header_length
+    if offset + 1 > len(frame):
+        raise ValueError('Header length exceeds frame')
+    header = codec.loads(frame[_HEADER_LENGTH.size:offset])
+    nonce_length = frame[offset]
+    nonce = frame[offset + 1:offset + 1 + nonce_length]
+    if len(nonce) != nonce_length:
+        raise ValueError('Nonce length exceeds frame')
+    return header, nonce, frame[offset + 1 + nonce_length:]
+
+
+# Base64 text of a value that may be raw bytes (binary clients) or already base64 text (JSON clients)
+def to_text(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode()
+    return value
+
+
+# Raw bytes of a value that may be base64 text; None if the text is not base64
+def to_bytes(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    try:
+        return base64.b64decode(value or '', validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+# Ciphertext and nonce of a message row as base64 text, whichever columns it was stored in
+def row_text(row):
+    if row.get('content_bytes') is not None:
+        return to_text(row['content_bytes']), to_text(row['nonce_bytes'] or b'')
+    return row['content'], row['nonce']
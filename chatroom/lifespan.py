@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import sys
+from .persistence import drain_message_writer
+from .redis_client import close_redis, get_redis, get_redis_shards
+
+logger = logging.getLogger(__name__)
+
+
+# ASGI lifespan handler: warm up shared resources on startup and release them on shutdown
+async def lifespan_app(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            for client in [get_redis(), *get_redis_shards()]:
+                try:
+                    await client.ping()
+                except Exception as e:
+                    logger.warning("Redis health check of %s failed on startup: %s", client, e)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# Flush queued write-behind messages, then close the Redis pools
+async def shutdown():
+    await drain_message_writer()
+    await close_redis()
+
+
+# Daphne never sends lifespan events; it runs the app on Twisted's asyncio reactor, so run the
+# shutdown from a "before shutdown" trigger, which the reactor waits for (on SIGTERM/SIGINT) before
+# stopping the event loop. Does nothing under other servers.
+def install_daphne_shutdown_hook():
+    if 'twisted.internet.reactor' not in sys.modules:
+        return
+    from twisted.internet import defer, reactor
+
+    def before_shutdown():
+        return defer.Deferred.fromFuture(asyncio.ensure_future(shutdown()))
+
+    reactor.addSystemEventTrigger('before', 'shutdown', before_shutdown)
@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+from chatroom import archive, unread
+from chatroom.models import MessageArchiveSegment
+
+
+# Move old, read messages into compressed per-session archive segments (see chatroom/archive.py).
+# Safe to run repeatedly (e.g. nightly from cron); every segment is its own short transaction.
+class Command(BaseCommand):
+    help = 'Archive messages older than CHAT_ARCHIVE AFTER_DAYS into compressed per-session segments'
+
+    def add_arguments(self, parser):
+        options = archive.options()
+        parser.add_argument('--days', type=int, default=options['AFTER_DAYS'], help='Archive messages older than this')
+        parser.add_argument('--segment-size', type=int, default=options['SEGMENT_SIZE'], help='Messages per segment')
+        parser.add_argument('--pause-ms', type=int, default=0, help='Pause between segments to spread the write load')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many messages are eligible')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old = unread.read_messages().filter(timestamp__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f"{old.count()} messages older than {options['days']} days are eligible for archival.")
+            return
+        session_pks = list(old.values_list('session_id', flat=True).distinct().order_by())
+        moved = segments = 0
+        started = time.perf_counter()
+        for session_pk in session_pks:
+            while True:
+                count = archive.archive_session(session_pk, cutoff, options['segment_size'])
+                if not count:
+                    break
+                moved += count
+                segments += 1
+                if options['pause_ms']:
+                    time.sleep(options['pause_ms'] / 1000)
+        totals = MessageArchiveSegment.objects.aggregate(messages=Sum('message_count'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} messages from {len(session_pks)} sessions into {segments} segments "
+            f"in {time.perf_counter() - started:.1f}s ({totals['messages'] or 0} messages archived in total)."
+        ))
@@ -0,0 +1,66 @@
+import threading
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from chatroom.models import Message, Session
+
+
+# Load test for the configured database: N writer threads insert chat messages concurrently,
+# the way database_sync_to_async threads do under load. Run it once per backend/settings
+# (SQLite with and without WAL, PostgreSQL with and without pooling) to compare messages/second.
+class Command(BaseCommand):
+    help = 'Measure message inserts per second with concurrent writer threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Number of concurrent writer threads')
+        parser.add_argument('--messages', type=int, default=500, help='Messages inserted by each writer')
+
+    def handle(self, *args, **options):
+        writers = options['writers']
+        per_writer = options['messages']
+        sender = User.objects.create_user(username='__bench_writer_a')
+        receiver = User.objects.create_user(username='__bench_writer_b')
+        session = Session.objects.create(
+            session_id='__bench_writer_session', sender=sender, receiver=receiver,
+            aes_key_encrypted_sender='', aes_key_encrypted_receiver='',
+        )
+        errors = []
+        written = []
+        start_barrier = threading.Barrier(writers + 1)
+
+        def write():
+            count = 0
+            try:
+                start_barrier.wait()
+                for i in range(per_writer):
+                    Message.objects.create(
+                        session_id=session.pk, sender_id=sender.pk, receiver_id=receiver.pk,
+                        content=f'ciphertext-{i}', nonce='nonce',
+                    )
+                    count += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                written.append(count)
+                connections.close_all()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        try:
+            for thread in threads:
+                thread.start()
+            start_barrier.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            # Deleting the users cascades to the session and its messages
+            User.objects.filter(pk__in=[sender.pk, receiver.pk]).delete()
+
+        self.stdout.write(f"backend: {connection.vendor}")
+        self.stdout.write(f"writers: {writers}, messages per writer: {per_writer}")
+        self.stdout.write(f"elapsed: {elapsed:.2f}s")
+        self.stdout.write(f"throughput: {sum(written) / elapsed:.0f} messages/s")
+        if errors:
+            self.stdout.write(self.style.ERROR(f"{len(errors)} writers failed, first error: {errors[0]}"))
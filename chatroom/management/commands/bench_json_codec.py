@@ -0,0 +1,40 @@
+import timeit
+from django.core.management.base import BaseCommand
+from chatroom import codec
+
+
+# Micro-benchmark of websocket frame encoding. Compares the old path, where every recipient's handler
+# json.dumps the event again, with encoding the frame once at the sender, for each available backend.
+class Command(BaseCommand):
+    help = 'Measure JSON encode cost per chat message fan-out for each codec backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, nargs='+', default=[2, 10, 100], help='Fan-out sizes to measure')
+        parser.add_argument('--message-bytes', type=int, default=256, help='Size of the (ciphertext) message field')
+        parser.add_argument('--number', type=int, default=2000, help='Fan-outs timed per measurement')
+
+    def handle(self, *args, **options):
+        event = {
+            'type': 'chat_message',
+            'message': 'A' * options['message_bytes'],
+            'sender_id': '42',
+            'nonce': 'bm9uY2Utbm9uY2Utbm9uY2U=',
+            'session_name': 'c5e0f2a4-6a53-4f0e-9a55-0c0b9f1e2d3c',
+            'timestamp': '09:41 PM',
+        }
+        number = options['number']
+        self.stdout.write(f"message field: {options['message_bytes']} bytes, {number} fan-outs per row")
+        self.stdout.write(f"{'backend':<8} {'recipients':>10} {'per-recipient us':>17} {'encode-once us':>15} {'speedup':>8}")
+        for name, (dumps, _) in codec.BACKENDS.items():
+            for recipients in options['recipients']:
+                def per_recipient():
+                    for _ in range(recipients):
+                        dumps(event)
+
+                def encode_once():
+                    dumps(event)
+
+                before = min(timeit.repeat(per_recipient, number=number, repeat=3)) / number * 1e6
+                after = min(timeit.repeat(encode_once, number=number, repeat=3)) / number * 1e6
+                self.stdout.write(f"{name:<8} {recipients:>10} {before:>17.2f} {after:>15.2f} {before / after:>7.1f}x")
+        self.stdout.write(f"active backend: {codec.backend_name()}")
@@ -0,0 +1,45 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from chatroom.consumers import ChatConsumer
+from chatroom.models import Session
+
+
+class Rollback(Exception):
+    pass
+
+
+# Measure how many SQL queries ChatConsumer spends persisting one chat frame.
+# Everything runs inside a transaction that is rolled back, so no data is left behind.
+class Command(BaseCommand):
+    help = 'Report database queries per chat message for ChatConsumer.save_message'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100, help='Number of messages to save')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        try:
+            with transaction.atomic():
+                sender = User.objects.create_user(username='__bench_sender')
+                receiver = User.objects.create_user(username='__bench_receiver')
+                session = Session.objects.create(
+                    session_id='__bench_session', sender=sender, receiver=receiver,
+                    aes_key_encrypted_sender='', aes_key_encrypted_receiver='',
+                )
+                consumer = ChatConsumer()
+                consumer.session_pk = session.pk
+                # async_to_sync from the main thread runs the async ORM calls back on this thread,
+                # inside the transaction and the query capture
+                save_message = async_to_sync(consumer.save_message)
+                with CaptureQueriesContext(connection) as ctx:
+                    for i in range(count):
+                        save_message(sender.id, receiver.id, f'ciphertext-{i}', 'nonce')
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(f"messages: {count}")
+        self.stdout.write(f"queries: {len(ctx.captured_queries)}")
+        self.stdout.write(f"queries per message: {len(ctx.captured_queries) / count:.2f}")
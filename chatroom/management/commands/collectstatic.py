@@ -0,0 +1,58 @@
+import os
+from django.conf import settings
+from django.contrib.staticfiles.management.commands.collectstatic import Command as CollectStaticCommand
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+
+def format_size(size):
+    return f"{size / 1024:.1f} KB" if size is not None else 'missing'
+
+
+# collectstatic followed by a size report of each WebAssembly bundle in WASM_BUNDLES: the source,
+# the hashed copy and its .gz/.br variants. A missing variant (e.g. brotli not installed) is flagged.
+class Command(CollectStaticCommand):
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--no-size-report', action='store_false', dest='size_report',
+                            help='Skip the WebAssembly bundle size report')
+
+    def handle(self, **options):
+        result = super().handle(**options)
+        if options['size_report'] and not options['dry_run']:
+            self.report_bundle_sizes()
+        return result
+
+    @staticmethod
+    def file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def report_bundle_sizes(self):
+        self.stdout.write("\nWebAssembly bundles:")
+        for name in getattr(settings, 'WASM_BUNDLES', []):
+            try:
+                hashed = staticfiles_storage.stored_name(name)
+            except ValueError:
+                self.stdout.write(self.style.ERROR(f"  {name}: not in the staticfiles manifest"))
+                continue
+            path = staticfiles_storage.path(hashed)
+            original = self.file_size(path)
+            if original is None:
+                self.stdout.write(self.style.ERROR(f"  {name}: {hashed} was not collected"))
+                continue
+            line = f"  {hashed}: {format_size(original)}"
+            missing = []
+            for suffix in ('.gz', '.br'):
+                size = self.file_size(path + suffix)
+                if size is None:
+                    missing.append(suffix)
+                else:
+                    line += f", {suffix[1:]} {format_size(size)} ({size / original:.0%})"
+            self.stdout.write(line)
+            if missing:
+                self.stdout.write(self.style.WARNING(
+                    f"    no {'/'.join(missing)} variant; install brotli for .br and check "
+                    f"WHITENOISE_SKIP_COMPRESS_EXTENSIONS"
+                ))
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import threading
+import time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from chatroom import unread
+from chatroom.cache import contact_cache
+from chatroom.models import Contact, Session
+from chatroom.redis_client import close_redis, get_sync_redis
+from chatroom.routing import websocket_urlpatterns
+
+USERNAME_PREFIX = '__load_'
+
+
+# Puts a fixed user in the websocket scope, standing in for AuthMiddlewareStack
+class ForceUser:
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        return await self.app(dict(scope, user=self.user), receive, send)
+
+
+# Counts every SQL query executed on any thread's connection
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 3)
+
+    return {
+        'count': len(samples),
+        'p50': pick(50),
+        'p90': pick(90),
+        'p99': pick(99),
+        'max': round(samples[-1], 3),
+        'mean': round(sum(samples) / len(samples), 3),
+    }
+
+
+# Self-contained load generator for the websocket consumers. Simulated users are created in the
+# configured database, paired up as contacts, and each opens ws/notifications/ plus ws/chat/<partner>/
+# in-process, then sends messages at a fixed rate. Presence needs the Redis at REDIS_URL; the channel
+# layer is in-memory by default or the configured one with --layer redis.
+class Command(BaseCommand):
+    help = 'Load test the chat and presence websocket consumers and report latency/query/Redis metrics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Number of simulated users (rounded up to even)')
+        parser.add_argument('--rate', type=float, default=2.0, help='Messages per second sent by each user')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of message traffic')
+        parser.add_argument('--layer', choices=['memory', 'redis'], default='memory', help='Channel layer to use')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        users = self.create_users(options['users'] + options['users'] % 2)
+        layers = None
+        if options['layer'] == 'memory':
+            layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        try:
+            with override_settings(**({'CHANNEL_LAYERS': layers} if layers else {})):
+                results = asyncio.run(self.run(users, counter, options))
+        finally:
+            connection_created.disconnect(counter.install)
+            self.delete_users(users)
+        results['config'] = {key: options[key] for key in ('users', 'rate', 'duration', 'layer')}
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def create_users(self, count):
+        self.delete_users(list(User.objects.filter(username__startswith=USERNAME_PREFIX)))
+        users = [User.objects.create_user(username=f'{USERNAME_PREFIX}{i}') for i in range(count)]
+        for a, b in zip(users[::2], users[1::2]):
+            Contact.objects.create(user=a, contact_user=b)
+            Contact.objects.create(user=b, contact_user=a)
+            Session.objects.create(
+                session_id=f'{a.username}_{b.username}', sender=a, receiver=b,
+                aes_key_encrypted_sender='', aes_key_encrypted_receiver='',
+            )
+        return users
+
+    def delete_users(self, users):
+        ids = [user.id for user in users]
+        if not ids:
+            return
+        User.objects.filter(id__in=ids).delete()
+        try:
+            contact_cache.invalidate(*ids)
+            get_sync_redis().delete(*(f'{unread.KEY_PREFIX}{user_id}' for user_id in ids))
+        except Exception:
+            pass
+
+    @staticmethod
+    def redis_commands_processed():
+        try:
+            return get_sync_redis().info('stats')['total_commands_processed']
+        except Exception:
+            return None
+
+    async def run(self, users, counter, options):
+        partners = {}
+        for a, b in zip(users[::2], users[1::2]):
+            partners[a.id], partners[b.id] = b, a
+        frames_sent = 0
+        message_latencies = []
+        rate_limited = 0
+        notify_latencies = []
+        chat_latencies = []
+        readers = []
+        sockets = []
+        running = True
+
+        async def read(comm, user_id):
+            nonlocal rate_limited
+            while True:
+                data = json.loads(await comm.receive_from(timeout=options['duration'] + 3600))
+                if data.get('type') == 'chat_message' and str(data['sender_id']) != str(user_id):
+                    message_latencies.append((time.perf_counter_ns() - int(data['message'])) / 1e6)
+                elif data.get('type') == 'rate_limited':
+                    rate_limited += 1
+
+        # Connect phase: every user opens a notifications socket and a chat socket
+        redis_before = self.redis_commands_processed()
+        for user in users:
+            started = time.perf_counter()
+            notifications = WebsocketCommunicator(ForceUser(URLRouter(websocket_urlpatterns), user), '/ws/notifications/')
+            connected, _ = await notifications.connect()
+            if not connected:
+                raise RuntimeError(f'Notification socket for {user.username} was rejected')
+            await notifications.receive_from(timeout=10)    # online_contacts, the first frame
+            notify_latencies.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            chat = WebsocketCommunicator(
+                ForceUser(URLRouter(websocket_urlpatterns), user), f'/ws/chat/{partners[user.id].id}/'
+            )
+            connected, _ = await chat.connect()
+            if not connected:
+                raise RuntimeError(f'Chat socket for {user.username} was rejected')
+            chat_latencies.append((time.perf_counter() - started) * 1000)
+            sockets += [notifications, chat]
+            readers.append(asyncio.create_task(read(chat, user.id)))
+        await asyncio.sleep(0.5)    # let background presence fan-out settle
+        redis_after = self.redis_commands_processed()
+
+        # Messaging phase
+        async def send(comm):
+            nonlocal frames_sent
+            interval = 1 / options['rate']
+            next_at = time.perf_counter()
+            while running:
+                await comm.send_to(text_data=json.dumps({'message': str(time.perf_counter_ns()), 'nonce': 'n'}))
+                frames_sent += 1
+                next_at += interval
+                await asyncio.sleep(max(0, next_at - time.perf_counter()))
+
+        for conn in connections.all(initialized_only=True):
+            counter.install(conn)
+        queries_before = counter.count
+        started = time.perf_counter()
+        senders = [asyncio.create_task(send(chat)) for chat in sockets[1::2]]
+        await asyncio.sleep(options['duration'])
+        running = False
+        await asyncio.gather(*senders)
+        await asyncio.sleep(1)      # drain in-flight frames
+        elapsed = time.perf_counter() - started
+        queries = counter.count - queries_before
+
+        for reader in readers:
+            reader.cancel()
+        for comm in sockets:
+            await comm.disconnect()
+        await close_redis()
+
+        return {
+            'notification_connect_ms': percentiles(notify_latencies),
+            'chat_connect_ms': percentiles(chat_latencies),
+            'message_latency_ms': percentiles(message_latencies),
+            'messages_sent': frames_sent,
+            'messages_delivered': len(message_latencies),
+            'messages_rate_limited': rate_limited,
+            'messages_per_second': round(frames_sent / elapsed, 1),
+            'db_queries_per_message': round(queries / frames_sent, 3) if frames_sent else None,
+            'redis_commands_per_user_connect': (
+                round((redis_after - redis_before) / len(users), 2)
+                if redis_before is not None and redis_after is not None else None
+            ),
+        }
@@ -0,0 +1,25 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from chatroom import unread
+
+
+# Rebuild the Redis unread counters from Message rows and read watermarks (run after deploys, Redis flushes or drift)
+class Command(BaseCommand):
+    help = 'Rebuild per (receiver, sender) unread counters from messages past each read watermark'
+
+    def handle(self, *args, **options):
+        counts = defaultdict(dict)
+        rows = (
+            unread.unread_messages()
+            .values('receiver_id', 'sender_id')
+            .annotate(unread=Count('id'))
+            .order_by()
+        )
+        for row in rows:
+            counts[str(row['receiver_id'])][str(row['sender_id'])] = row['unread']
+        unread.replace_all(counts)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt unread counters for {len(counts)} receivers "
+            f"({sum(len(senders) for senders in counts.values())} conversations)."
+        ))
@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from chatroom import presence
+from chatroom.redis_client import HashRing, get_sync_redis, shard_urls
+
+
+# Checks a sharded deployment: pings every node in REDIS_URLS, shows how many online users each
+# node holds, and simulates how user ids spread over the hash ring (and how many move if a node is added).
+class Command(BaseCommand):
+    help = 'Show the Redis shard topology, per-node presence load and consistent-hash key distribution'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simulate', type=int, default=100000, help='Number of user ids to place on the ring')
+        parser.add_argument('--add-node', help='Also report how many ids would move if this node URL were added')
+
+    def handle(self, *args, **options):
+        urls = shard_urls()
+        self.stdout.write(f"{len(urls)} shard node(s)")
+        for url in urls:
+            client = get_sync_redis(url)
+            try:
+                started = time.perf_counter()
+                client.ping()
+                latency = (time.perf_counter() - started) * 1000
+                online = client.zcard(presence.USERS_INDEX_KEY)
+                self.stdout.write(f"  {url}: up, ping {latency:.2f} ms, {online} users in presence index")
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"  {url}: unreachable ({e})"))
+
+        count = options['simulate']
+        ring = HashRing(urls)
+        placement = [ring.get_node(user_id) for user_id in range(1, count + 1)]
+        self.stdout.write(f"distribution of {count} user ids:")
+        for url in urls:
+            share = placement.count(url)
+            self.stdout.write(f"  {url}: {share} ({share / count:.1%}, ideal {1 / len(urls):.1%})")
+        if options['add_node']:
+            grown = HashRing(urls + [options['add_node']])
+            moved = sum(1 for user_id, node in enumerate(placement, 1) if grown.get_node(user_id) != node)
+            self.stdout.write(
+                f"adding {options['add_node']} moves {moved} ids ({moved / count:.1%}, ideal {1 / (len(urls) + 1):.1%})"
+            )
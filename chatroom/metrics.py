@@ -0,0 +1,220 @@
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+"""
+Lightweight in-process metrics with a Prometheus text exposition.
+
+Enabled with CHAT_METRICS['ENABLED']. When disabled, every instrumentation point is a single flag
+check. Operations slower than CHAT_METRICS['SLOW_MS'] are logged on the 'chatroom.metrics' logger.
+Metrics are per worker process; scrape each worker (or run one worker per scrape target).
+"""
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_enabled = None
+_slow_seconds = None
+_lock = threading.Lock()
+_metrics = {}
+
+
+def enabled():
+    global _enabled, _slow_seconds
+    if _enabled is None:
+        options = getattr(settings, 'CHAT_METRICS', {})
+        _slow_seconds = options.get('SLOW_MS', 250) / 1000
+        _enabled = options.get('ENABLED', False)
+    return _enabled
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name + _format_labels(key), value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            counts, total, observations = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, observations + 1)
+
+    def samples(self):
+        samples = []
+        for key, (counts, total, observations) in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                samples.append((self.name + '_bucket' + _format_labels(key, [('le', bound)]), count))
+            samples.append((self.name + '_bucket' + _format_labels(key, [('le', '+Inf')]), observations))
+            samples.append((self.name + '_sum' + _format_labels(key), total))
+            samples.append((self.name + '_count' + _format_labels(key), observations))
+        return samples
+
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name, help_text):
+    return _register(Counter(name, help_text))
+
+
+def gauge(name, help_text):
+    return _register(Gauge(name, help_text))
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, buckets))
+
+
+operation_seconds = histogram('chat_operation_duration_seconds', 'Duration of instrumented consumer/view operations')
+slow_operations = counter('chat_slow_operations_total', 'Operations slower than CHAT_METRICS SLOW_MS')
+active_connections = gauge('chat_active_websocket_connections', 'Open websocket connections in this worker')
+frames_received = counter('chat_websocket_frames_received_total', 'Websocket frames received from clients')
+db_queries = counter('chat_db_queries_total', 'SQL queries executed by this worker')
+http_db_queries = histogram(
+    'chat_http_request_db_queries', 'SQL queries per HTTP request', buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+frames_coalesced = counter('chat_notification_frames_coalesced_total', 'Notification frames replaced by a newer one before sending')
+frames_rate_limited = counter('chat_websocket_frames_rate_limited_total', 'Websocket frames dropped by the rate limiter')
+queue_depth = gauge('chat_queue_depth', 'Messages waiting in in-process queues')
+
+
+# Record one timed operation, logging it if slow
+def record(operation, elapsed):
+    operation_seconds.observe(elapsed, operation=operation)
+    if elapsed >= _slow_seconds:
+        slow_operations.inc(operation=operation)
+        logger.warning("Slow operation %s took %.1f ms", operation, elapsed * 1000)
+
+
+# Time a block of code under the given operation name
+@contextmanager
+def timer(operation):
+    if not enabled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(operation, time.perf_counter() - started)
+
+
+# Decorator timing a sync or async function under the given operation name
+def timed(operation):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled():
+                    return await func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(operation, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(operation, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# Counts every SQL query on connections opened while metrics are enabled
+def count_query(execute, sql, params, many, context):
+    db_queries.inc()
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs):
+    if enabled() and count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+# Queue depths sampled at scrape time
+def _collect_queue_depths():
+    from channels.layers import get_channel_layer
+    from .persistence import pending_messages
+    layer = get_channel_layer()
+    buffers = getattr(layer, 'receive_buffer', None)     # channels_redis
+    if buffers is not None:
+        queue_depth.set(sum(queue.qsize() for queue in buffers.values()), queue='channel_layer')
+    elif hasattr(layer, 'channels'):                      # InMemoryChannelLayer
+        queue_depth.set(sum(queue.qsize() for queue in layer.channels.values()), queue='channel_layer')
+    queue_depth.set(pending_messages(), queue='write_behind')
+
+
+# Render every metric in the Prometheus text format
+def render():
+    try:
+        _collect_queue_depths()
+    except Exception as e:
+        logger.warning("Could not sample queue depths: %s", e)
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, value in metric.samples():
+                lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
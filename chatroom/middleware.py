@@ -0,0 +1,27 @@
+import time
+from django.db import connection
+from . import metrics
+
+
+# Records duration and SQL query count of every HTTP request per view when CHAT_METRICS is enabled
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.enabled():
+            return self.get_response(request)
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        view = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        metrics.record(f'http_{view}', time.perf_counter() - started)
+        metrics.http_db_queries.observe(queries, view=view)
+        return response
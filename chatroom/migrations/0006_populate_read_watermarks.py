@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.db.models import Max, Min
+
+
+# Derive each participant's watermark from the per-row is_read flags: everything before their
+# oldest unread message in the session, or the whole session if nothing is unread
+def populate_watermarks(apps, schema_editor):
+    Message = apps.get_model('chatroom', 'Message')
+    Session = apps.get_model('chatroom', 'Session')
+    ReadWatermark = apps.get_model('chatroom', 'ReadWatermark')
+    first_unread = {
+        (row['session_id'], row['receiver_id']): row['first_unread']
+        for row in Message.objects.filter(is_read=False)
+        .values('session_id', 'receiver_id').annotate(first_unread=Min('id')).order_by()
+    }
+    watermarks = []
+    sessions = Session.objects.annotate(newest=Max('messages__id')).filter(newest__isnull=False)
+    for session_id, sender_id, receiver_id, newest in sessions.values_list('id', 'sender_id', 'receiver_id', 'newest'):
+        for user_id in (sender_id, receiver_id):
+            unread_from = first_unread.get((session_id, user_id))
+            watermarks.append(ReadWatermark(
+                user_id=user_id,
+                session_id=session_id,
+                last_read_message_id=newest if unread_from is None else unread_from - 1,
+            ))
+    ReadWatermark.objects.bulk_create(watermarks, batch_size=1000)
+
+
+# Restore the is_read flags from the watermarks
+def restore_is_read(apps, schema_editor):
+    Message = apps.get_model('chatroom', 'Message')
+    ReadWatermark = apps.get_model('chatroom', 'ReadWatermark')
+    for watermark in ReadWatermark.objects.all().iterator():
+        Message.objects.filter(
+            session_id=watermark.session_id, receiver_id=watermark.user_id, id__lte=watermark.last_read_message_id,
+        ).update(is_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatroom', '0005_read_watermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_watermarks, restore_is_read),
+    ]
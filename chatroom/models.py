@@ -21,15 +21,62 @@ class Message(models.Model):
     session = models.ForeignKey(Session, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
-    content = models.TextField()
+    content = models.TextField(blank=True)
     nonce = models.TextField(blank=True)
+    # Raw ciphertext/nonce of messages sent over the binary subprotocol (content/nonce are then empty)
+    content_bytes = models.BinaryField(null=True, blank=True)
+    nonce_bytes = models.BinaryField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Deprecated: read state lives in ReadWatermark; no longer read or written, to be dropped
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # History is read per conversation, paged by id; unread counts are a range past a watermark
+            models.Index(fields=['session', 'id'], name='message_session_id_idx'),
+        ]
+
     def __str__(self):
         return f"From {self.sender.username} to {self.receiver.username}"
 
 
+# Read state of one participant in a conversation: every message of the session with
+# id <= last_read_message_id is read by this user (see chatroom/unread.py)
+class ReadWatermark(models.Model):
+    user = models.ForeignKey(User, related_name='read_watermarks', on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, related_name='read_watermarks', on_delete=models.CASCADE)
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'session'], name='read_watermark_user_session_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} read {self.session.session_id} up to {self.last_read_message_id}"
+
+
+# Archived messages of one session: a contiguous run of its oldest messages, stored compressed
+# in a single row (see chatroom/archive.py)
+class MessageArchiveSegment(models.Model):
+    session = models.ForeignKey(Session, related_name='archive_segments', on_delete=models.CASCADE)
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Archived history is read per conversation, newest segment first
+            models.Index(fields=['session', 'last_message_id'], name='archive_session_last_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archive of {self.session.session_id} ({self.first_message_id}-{self.last_message_id})"
+
+
 class Contact(models.Model):
     user = models.ForeignKey(User, related_name='contacts', on_delete=models.CASCADE)
     contact_user = models.ForeignKey(User, related_name='contacted_by', on_delete=models.CASCADE)
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import frames, metrics, unread
+
+logger = logging.getLogger(__name__)
+
+"""
+Write-behind message persistence.
+
+With CHAT_WRITE_BEHIND['ENABLED'], ChatConsumer broadcasts a frame immediately and hands the message
+to a per-process MessageWriter, which inserts queued messages with bulk_create every BATCH_SIZE
+messages or FLUSH_INTERVAL_MS milliseconds. Once a batch commits, each message's chat room receives a
+message_committed event carrying the original nonce and the new message id (or success=False), so the
+sender is acknowledged and every participant learns the id of a message it was shown with id null.
+The writer itself counts committed messages as unread and notifies their receivers, first, so this
+happens even if the sender's connection is gone and a receiver's mark_read sent on message_committed
+clears the count again.
+The queue is drained on server shutdown (see lifespan.py).
+"""
+
+_writer = None
+
+
+def write_behind_enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', {}).get('ENABLED', False)
+
+
+class MessageWriter:
+    def __init__(self):
+        options = getattr(settings, 'CHAT_WRITE_BEHIND', {})
+        self.batch_size = options.get('BATCH_SIZE', 100)
+        self.flush_interval = options.get('FLUSH_INTERVAL_MS', 50) / 1000
+        self.queue = asyncio.Queue(maxsize=options.get('MAX_PENDING', 10000))
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.create_task(self._run())
+
+    # Queue a message for persistence; once it is committed the result goes to the room group, where
+    # reply_channel (the sender's connection) acknowledges it
+    async def enqueue(self, message, group, reply_channel):
+        await self.queue.put((message, group, reply_channel))
+
+    # Flush everything still queued and stop the worker
+    async def drain(self):
+        await self.queue.put(None)
+        await self.task
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            deadline = self.loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    @metrics.timed('write_behind_flush')
+    async def _flush(self, batch):
+        messages = [message for message, _, _ in batch]
+        try:
+            await self._bulk_create(messages)
+            success = True
+        except Exception:
+            logger.exception("Write-behind flush of %d messages failed", len(messages))
+            success = False
+        channel_layer = get_channel_layer()
+        for message, group, reply_channel in batch:
+            if success:
+                await self._notify_unread(message)
+            try:
+                await channel_layer.group_send(group, {
+                    'type': 'message_committed',   # This will call ChatConsumer.message_committed
+                    'success': success,
+                    'id': message.pk if success else None,
+                    'nonce': frames.to_text(message.nonce_bytes) if message.content_bytes is not None else message.nonce,
+                    'reply_channel': reply_channel,
+                })
+            except Exception as e:
+                logger.warning("Could not report committed message to %s: %s", group, e)
+
+    # Count a committed message as unread and push the receiver's new count for its sender
+    @staticmethod
+    async def _notify_unread(message):
+        from .consumers import NotificationConsumer
+        sender_id, receiver_id = str(message.sender_id), str(message.receiver_id)
+        try:
+            try:
+                unread_count = await unread.increment(receiver_id, sender_id)
+            except Exception as e:
+                logger.warning("Unread counter update failed, counting from the database: %s", e)
+                unread_count = await unread.unread_in_session(receiver_id, message.session_id, sender_id).acount()
+            await NotificationConsumer.notify_unread_message(receiver_id, sender_id, unread_count)
+        except Exception as e:
+            logger.warning("Could not notify %s of an unread message: %s", receiver_id, e)
+
+    @staticmethod
+    async def _bulk_create(messages):
+        from .models import Message
+        return await Message.objects.abulk_create(messages)
+
+
+# Get the process-wide writer, starting it on the running event loop if needed
+def get_message_writer():
+    global _writer
+    if _writer is None or _writer.loop is not asyncio.get_running_loop():
+        _writer = MessageWriter()
+    return _writer
+
+
+# Number of messages waiting to be flushed
+def pending_messages():
+    return _writer.queue.qsize() if _writer is not None else 0
+
+
+# Flush pending messages on shutdown
+async def drain_message_writer():
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        await writer.drain()
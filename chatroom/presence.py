@@ -0,0 +1,140 @@
+import asyncio
+import time
+from django.conf import settings
+from .redis_client import get_redis_for, get_redis_shards, group_by_shard
+
+"""
+Multi-connection presence backed by expiring heartbeats.
+
+Every websocket connection of a user is a member of the sorted set presence:<user_id>, scored by
+the time its heartbeat expires. presence:users indexes each online user by their latest expiry, so
+online checks are a single ZSCORE and ghosts left by crashed workers can be swept in bulk.
+Transitions are reported only on real edges: first live connection -> online, last one -> offline.
+
+With several REDIS_URLS a user's keys live on the node picked by a consistent hash of the user id
+(see redis_client.py). Every node keeps its own presence:users index and sweep lock, so bulk lookups
+are split per node and sweeps run on each node independently.
+"""
+
+USER_KEY_PREFIX = 'presence:'
+USERS_INDEX_KEY = 'presence:users'
+SWEEP_LOCK_KEY = 'presence:sweep_lock'
+
+
+def _options():
+    options = getattr(settings, 'PRESENCE', {})
+    return {
+        'HEARTBEAT_INTERVAL': options.get('HEARTBEAT_INTERVAL', 30),
+        'TTL': options.get('TTL', 90),
+        'SWEEP_BATCH': options.get('SWEEP_BATCH', 500),
+    }
+
+
+def heartbeat_interval():
+    return _options()['HEARTBEAT_INTERVAL']
+
+
+# Add/refresh a connection; returns how many live connections the user had before
+_TOUCH_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local before = redis.call('ZCARD', KEYS[1])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+local latest = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')[2]
+redis.call('ZADD', KEYS[2], tostring(latest), ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return before
+"""
+
+# Drop a connection; returns how many live connections the user still has
+_REMOVE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local remaining = redis.call('ZCARD', KEYS[1])
+if remaining == 0 then
+    redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[2], ARGV[3])
+else
+    local latest = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')[2]
+    redis.call('ZADD', KEYS[2], tostring(latest), ARGV[3])
+end
+return remaining
+"""
+
+# Remove users whose every connection has expired; returns their ids
+_SWEEP_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, user_id in ipairs(stale) do
+    redis.call('DEL', ARGV[3] .. user_id)
+    redis.call('ZREM', KEYS[1], user_id)
+end
+return stale
+"""
+
+
+async def _touch(user_id, channel_name):
+    options = _options()
+    now = time.time()
+    return await get_redis_for(user_id).eval(
+        _TOUCH_SCRIPT, 2, USER_KEY_PREFIX + user_id, USERS_INDEX_KEY,
+        channel_name, now, now + options['TTL'], user_id, options['TTL'],
+    )
+
+
+# Register a new connection; True if the user just came online
+async def connect(user_id, channel_name):
+    return await _touch(user_id, channel_name) == 0
+
+
+# Refresh a connection's heartbeat; True if the user had been swept and is online again
+async def refresh(user_id, channel_name):
+    return await _touch(user_id, channel_name) == 0
+
+
+# Unregister a connection; True if it was the user's last live connection
+async def disconnect(user_id, channel_name):
+    remaining = await get_redis_for(user_id).eval(
+        _REMOVE_SCRIPT, 2, USER_KEY_PREFIX + user_id, USERS_INDEX_KEY,
+        channel_name, time.time(), user_id,
+    )
+    return remaining == 0
+
+
+# Check if a user has at least one live connection
+async def is_online(user_id):
+    expires = await get_redis_for(user_id).zscore(USERS_INDEX_KEY, user_id)
+    return expires is not None and expires > time.time()
+
+
+async def _expiries(client, user_ids):
+    async with client.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.zscore(USERS_INDEX_KEY, user_id)
+        return dict(zip(user_ids, await pipe.execute()))
+
+
+# Check which of the given users are online in one round trip per node
+async def online_users(user_ids):
+    if not user_ids:
+        return []
+    now = time.time()
+    expiries = {}
+    for shard in await asyncio.gather(*(_expiries(client, ids) for client, ids in group_by_shard(user_ids))):
+        expiries.update(shard)
+    return [user_id for user_id in user_ids if expiries[user_id] is not None and expiries[user_id] > now]
+
+
+async def _sweep_node(client, options):
+    if not await client.set(SWEEP_LOCK_KEY, 1, nx=True, ex=options['HEARTBEAT_INTERVAL']):
+        return []
+    return await client.eval(
+        _SWEEP_SCRIPT, 1, USERS_INDEX_KEY,
+        time.time(), options['SWEEP_BATCH'], USER_KEY_PREFIX,
+    )
+
+
+# Remove ghosts left by crashed workers; returns the ids that went offline.
+# Only one worker sweeps each node per heartbeat interval.
+async def sweep():
+    options = _options()
+    swept = await asyncio.gather(*(_sweep_node(client, options) for client in get_redis_shards()))
+    return [user_id for node in swept for user_id in node]
@@ -0,0 +1,138 @@
+import asyncio
+import bisect
+import hashlib
+from django.conf import settings
+import redis
+import redis.asyncio as aioredis
+
+"""
+Process-wide Redis clients shared by every consumer and view.
+
+The connection pools are created lazily on first use and sized from the REDIS_URL / REDIS_POOL
+settings. redis.asyncio pools are bound to the event loop they were created on, so the async clients
+are rebuilt if they are requested from a different loop (management commands, tests). The sync client
+is thread-safe and used from regular Django views.
+
+With several REDIS_URLS, per-user data (presence) is partitioned across the nodes with a consistent
+hash ring: get_redis_for(key) returns the node owning a key, and adding a node only moves about
+1/N of the keys. get_redis() is always the REDIS_URL node.
+"""
+
+# Points per node on the hash ring; more points spread keys more evenly
+RING_REPLICAS = 160
+
+_clients = {}
+_client_loop = None
+_sync_clients = {}
+_ring = None
+
+
+# Connection options shared by the async and sync pools
+def _pool_kwargs():
+    options = getattr(settings, 'REDIS_POOL', {})
+    return {
+        'decode_responses': True,
+        'max_connections': options.get('MAX_CONNECTIONS', 50),
+        'health_check_interval': options.get('HEALTH_CHECK_INTERVAL', 30),
+        'socket_timeout': options.get('SOCKET_TIMEOUT', 5),
+        'socket_connect_timeout': options.get('SOCKET_CONNECT_TIMEOUT', 5),
+        'socket_keepalive': True,
+        'retry_on_timeout': True,
+    }
+
+
+# Consistent hash ring mapping keys to nodes
+class HashRing:
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        self.nodes = list(nodes)
+        points = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def get_node(self, key):
+        index = bisect.bisect(self.hashes, self._hash(str(key))) % len(self.hashes)
+        return self.owners[index]
+
+
+# Every Redis node holding sharded data
+def shard_urls():
+    return list(getattr(settings, 'REDIS_URLS', None) or [settings.REDIS_URL])
+
+
+def _get_ring():
+    global _ring
+    urls = shard_urls()
+    if _ring is None or _ring.nodes != urls:
+        _ring = HashRing(urls)
+    return _ring
+
+
+def _get_client(url):
+    global _client_loop
+    loop = asyncio.get_running_loop()
+    if _client_loop is not loop:
+        _clients.clear()
+        _client_loop = loop
+    if url not in _clients:
+        pool = aioredis.ConnectionPool.from_url(url, **_pool_kwargs())
+        _clients[url] = aioredis.Redis(connection_pool=pool)
+    return _clients[url]
+
+
+# Get the shared async Redis client, creating the pool on first use
+def get_redis():
+    return _get_client(settings.REDIS_URL)
+
+
+# URL of the node that owns a sharded key (e.g. a user id)
+def shard_url(key):
+    urls = shard_urls()
+    return urls[0] if len(urls) == 1 else _get_ring().get_node(key)
+
+
+# Get the async client of the node that owns a sharded key
+def get_redis_for(key):
+    return _get_client(shard_url(key))
+
+
+# Get the async clients of every shard node
+def get_redis_shards():
+    return [_get_client(url) for url in shard_urls()]
+
+
+# Split keys by owning node: [(async client, [keys]), ...]
+def group_by_shard(keys):
+    groups = {}
+    for key in keys:
+        groups.setdefault(shard_url(key), []).append(key)
+    return [(_get_client(url), group) for url, group in groups.items()]
+
+
+# Get the shared sync Redis client for use outside the event loop (views, commands)
+def get_sync_redis(url=None):
+    url = url or settings.REDIS_URL
+    if url not in _sync_clients:
+        pool = redis.ConnectionPool.from_url(url, **_pool_kwargs())
+        _sync_clients[url] = redis.Redis(connection_pool=pool)
+    return _sync_clients[url]
+
+
+# Close the shared clients and disconnect every pooled connection
+async def close_redis():
+    global _client_loop
+    clients = list(_clients.values())
+    _clients.clear()
+    _client_loop = None
+    for client in clients:
+        await client.aclose()
+        await client.connection_pool.disconnect()
+    sync_clients = list(_sync_clients.values())
+    _sync_clients.clear()
+    for sync_client in sync_clients:
+        sync_client.connection_pool.disconnect()
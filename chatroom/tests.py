@@ -0,0 +1,238 @@
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from authentication.models import Profile
+from . import codec, flowcontrol, redis_client, unread
+from .management.commands.loadtest import ForceUser
+from .models import Contact, FriendRequest, Message, ReadWatermark, Session
+from .routing import websocket_urlpatterns
+from .views import history_page
+
+# Queries of GET /chats/ with a logged-in user and Redis unread counters:
+# session + user (auth), friend requests, contacts, and the profile of the user
+CHATS_QUERY_BUDGET = 5
+
+
+# Templates render {% static %} without a collectstatic manifest
+PLAIN_STATIC_STORAGES = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+# Users with profiles, created in bulk (no password hashing, no profile signals)
+def create_users(*usernames):
+    users = User.objects.bulk_create([User(username=username) for username in usernames])
+    Profile.objects.bulk_create([
+        Profile(user=user, mobile='0000000000', profile_picture='profile_pics/default.png', public_key='key')
+        for user in users
+    ])
+    return users
+
+
+# The sidebar is built in a constant number of queries, however many contacts and requests there are
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+@mock.patch('chatroom.unread.get_counts', return_value={})
+class ChatsQueryCountTests(TestCase):
+    def setUp(self):
+        self.user, = create_users('owner')
+        self.client.force_login(self.user)
+
+    def add_contacts(self, count):
+        contacts = create_users(*(f'contact{i}' for i in range(count)))
+        requesters = create_users(*(f'requester{i}' for i in range(count)))
+        Contact.objects.bulk_create([Contact(user=self.user, contact_user=contact) for contact in contacts])
+        FriendRequest.objects.bulk_create([FriendRequest(sender=sender, receiver=self.user) for sender in requesters])
+
+    def assert_chats_queries(self, contacts):
+        self.add_contacts(contacts)
+        with self.assertNumQueries(CHATS_QUERY_BUDGET):
+            response = self.client.get(reverse('chats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['contacts']), contacts)
+
+    def test_few_contacts(self, get_counts):
+        self.assert_chats_queries(3)
+
+    def test_many_contacts(self, get_counts):
+        self.assert_chats_queries(30)
+
+
+# Hot message reads stay index range scans (SQLite plans; PostgreSQL picks plans by table statistics)
+@skipUnless(connection.vendor == 'sqlite', 'asserts SQLite EXPLAIN QUERY PLAN output')
+class MessageQueryPlanTests(TestCase):
+    def assert_plan(self, queryset, *expected):
+        plan = queryset.explain()
+        for step in expected:
+            self.assertIn(step, plan)
+        self.assertNotIn('SCAN chatroom_message', plan)
+
+    def test_history_page(self):
+        self.assert_plan(
+            history_page(1)[:51],
+            'SEARCH chatroom_message USING INDEX message_session_id_idx (session_id=?)',
+        )
+
+    def test_history_page_before_cursor(self):
+        self.assert_plan(
+            history_page(1, before=100)[:51],
+            'SEARCH chatroom_message USING INDEX message_session_id_idx (session_id=? AND id<?)',
+        )
+
+    # Unread count of one conversation: the range of the session past the receiver's watermark,
+    # with the watermark found through its (user, session) unique index
+    def test_unread_count_in_session(self):
+        self.assert_plan(
+            unread.unread_in_session(2, 1, 3),
+            'SEARCH chatroom_message USING INDEX message_session_id_idx (session_id=? AND id>?)',
+            'USING INDEX sqlite_autoindex_chatroom_readwatermark_1 (user_id=? AND session_id=?)',
+        )
+
+    # Unread counts per sender for the sidebar when Redis is unavailable (views.get_unread_counts)
+    def test_unread_counts_of_receiver(self):
+        self.assert_plan(
+            unread.unread_messages(2).values('sender_id').annotate(unread=Count('id')).order_by(),
+            'SEARCH chatroom_message USING INDEX chatroom_message_receiver_id',
+            'USING INDEX sqlite_autoindex_chatroom_readwatermark_1 (user_id=? AND session_id=?)',
+        )
+
+
+# Read state only moves forward, whatever order the reads of a conversation arrive in
+class ReadWatermarkTests(TestCase):
+    def setUp(self):
+        sender, receiver = create_users('sender', 'receiver')
+        self.user_id = receiver.id
+        self.session = Session.objects.create(
+            session_id='watermark', sender=sender, receiver=receiver,
+            aes_key_encrypted_sender='', aes_key_encrypted_receiver='',
+        )
+
+    def watermark(self):
+        return ReadWatermark.objects.get(user_id=self.user_id, session=self.session).last_read_message_id
+
+    async def test_created_on_first_read(self):
+        await unread.set_watermark(self.user_id, self.session.pk, 10)
+        self.assertEqual(await ReadWatermark.objects.filter(user_id=self.user_id).acount(), 1)
+
+    async def test_moves_forward(self):
+        await unread.set_watermark(self.user_id, self.session.pk, 10)
+        await unread.set_watermark(self.user_id, self.session.pk, 20)
+        self.assertEqual(await sync_to_async(self.watermark)(), 20)
+
+    async def test_never_moves_back(self):
+        await unread.set_watermark(self.user_id, self.session.pk, 20)
+        await unread.set_watermark(self.user_id, self.session.pk, 10)
+        self.assertEqual(await sync_to_async(self.watermark)(), 20)
+
+
+# A socket closed for flooding processes nothing that was queued behind the close
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_WRITE_BEHIND={'ENABLED': False},
+    CHAT_FLOW_CONTROL={'SOCKET_RATE': 0.001, 'SOCKET_BURST': 1, 'USER_RATE': 0, 'DISCONNECT_AFTER': 2},
+)
+@mock.patch('chatroom.unread.increment', return_value=1)
+class RateLimitDisconnectTests(TestCase):
+    def setUp(self):
+        self.sender, self.receiver = create_users('sender', 'receiver')
+        self.session = Session.objects.create(
+            session_id='flood', sender=self.sender, receiver=self.receiver,
+            aes_key_encrypted_sender='', aes_key_encrypted_receiver='',
+        )
+
+    async def test_frames_after_close_are_dropped(self, increment):
+        communicator = WebsocketCommunicator(
+            ForceUser(URLRouter(websocket_urlpatterns), self.sender), f'/ws/chat/{self.receiver.id}/',
+        )
+        await communicator.connect()
+        for i in range(20):
+            await communicator.send_to(text_data=codec.dumps({'message': 'bWVzc2FnZQ==', 'nonce': f'nonce{i}'}))
+        while (output := await communicator.receive_output())['type'] != 'websocket.close':
+            pass
+        self.assertEqual(output['code'], flowcontrol.CLOSE_RATE_LIMITED)
+        await communicator.wait()
+        self.assertEqual(await Message.objects.filter(session=self.session).acount(), 1)
+
+
+# Keys of a conversation are found by its participants and only returned to them
+@mock.patch('chatroom.views.public_key_cache.get', side_effect=lambda key, loader: loader())
+@mock.patch('chatroom.views.session_key_cache.get', side_effect=lambda key, loader: loader())
+class SessionKeysTests(TestCase):
+    def setUp(self):
+        self.outsider, sender, receiver = create_users('a', 'a_b', 'c')
+        Session.objects.create(
+            session_id='a_b_c', sender=sender, receiver=receiver,
+            aes_key_encrypted_sender='key of a_b', aes_key_encrypted_receiver='key of c',
+        )
+
+    def get_session_id(self, user, sender, receiver):
+        self.client.force_login(user)
+        return self.client.post(
+            reverse('get_session_id'), codec.dumps({'sender': sender, 'receiver': receiver}),
+            content_type='application/json',
+        ).json()
+
+    def test_participant(self, session_get, public_key_get):
+        response = self.get_session_id(User.objects.get(username='c'), 'c', 'a_b')
+        self.assertEqual(response['session_id'], 'a_b_c')
+        self.assertEqual(response['aes_key'], 'key of c')
+        self.assertEqual(response['uname'], 'a_b')
+
+    # "a" + "b_c" spells the session id of a_b and c
+    def test_ambiguous_session_id(self, session_get, public_key_get):
+        response = self.get_session_id(self.outsider, 'a', 'b_c')
+        self.assertFalse(response['success'])
+        self.assertNotIn('aes_key', response)
+
+
+SHARD_URLS = ['redis://shard-a:6379/0', 'redis://shard-b:6379/0', 'redis://shard-c:6379/0']
+
+
+# Placement of sharded keys (user ids) on the consistent hash ring
+class HashRingTests(SimpleTestCase):
+    keys = [str(user_id) for user_id in range(1, 30001)]
+
+    def placement(self, ring):
+        return {key: ring.get_node(key) for key in self.keys}
+
+    def test_deterministic(self):
+        ring = redis_client.HashRing(SHARD_URLS)
+        self.assertEqual(self.placement(ring), self.placement(redis_client.HashRing(SHARD_URLS)))
+        self.assertEqual(self.placement(ring), self.placement(redis_client.HashRing(reversed(SHARD_URLS))))
+
+    def test_balanced(self):
+        placement = self.placement(redis_client.HashRing(SHARD_URLS))
+        for url in SHARD_URLS:
+            share = list(placement.values()).count(url) / len(self.keys)
+            self.assertTrue(0.25 < share < 0.42, f"{url} owns {share:.0%} of the keys")
+
+    # A new node takes about 1/N of the keys, and only keys that now belong to it move
+    def test_adding_a_node(self):
+        before = self.placement(redis_client.HashRing(SHARD_URLS))
+        after = self.placement(redis_client.HashRing(SHARD_URLS + ['redis://shard-d:6379/0']))
+        moved = [key for key in self.keys if before[key] != after[key]]
+        self.assertTrue(0.15 < len(moved) / len(self.keys) < 0.35, f"{len(moved)} keys moved")
+        self.assertEqual({after[key] for key in moved}, {'redis://shard-d:6379/0'})
+
+    @override_settings(REDIS_URLS=SHARD_URLS)
+    async def test_group_by_shard_matches_shard_url(self):
+        keys = self.keys[:300]
+        groups = redis_client.group_by_shard(keys)
+        self.assertEqual(sorted(key for _, group in groups for key in group), sorted(keys))
+        self.assertEqual(len(groups), len(SHARD_URLS))
+        for client, group in groups:
+            self.assertEqual({redis_client.shard_url(key) for key in group}, {self.url_of(client)})
+            for key in group:
+                self.assertIs(redis_client.get_redis_for(key), client)
+
+    @staticmethod
+    def url_of(client):
+        kwargs = client.connection_pool.connection_kwargs
+        return f"redis://{kwargs['host']}:{kwargs['port']}/{kwargs['db']}"
@@ -0,0 +1,100 @@
+from django.db.models import BigIntegerField, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .redis_client import get_redis, get_sync_redis
+
+"""
+Maintained unread counters.
+
+unread:<receiver_id> is a Redis hash of sender_id -> number of unread messages. Counters are
+incremented when a message is committed and cleared when the receiver marks the conversation read,
+so nothing has to COUNT(*) the message table on the hot path. `manage.py rebuild_unread_counts`
+rebuilds every hash from the database.
+
+In the database, read state is a ReadWatermark per (user, session): a message is unread by its
+receiver while its id is above the receiver's watermark for the session. Marking a conversation
+read moves the watermark forward (set_watermark) instead of updating every unread row.
+"""
+
+KEY_PREFIX = 'unread:'
+
+
+def _key(receiver_id):
+    return f"{KEY_PREFIX}{receiver_id}"
+
+
+# Count one more unread message; returns the new count
+async def increment(receiver_id, sender_id, amount=1):
+    return await get_redis().hincrby(_key(receiver_id), sender_id, amount)
+
+
+# Count one more unread message from sync code (views)
+def increment_sync(receiver_id, sender_id, amount=1):
+    return get_sync_redis().hincrby(_key(receiver_id), sender_id, amount)
+
+
+# Clear the unread count of one sender
+async def reset(receiver_id, sender_id):
+    await get_redis().hdel(_key(receiver_id), sender_id)
+
+
+# Get all unread counts of a receiver as {sender_id: count} (sync, for views)
+def get_counts(receiver_id):
+    return {sender_id: int(count) for sender_id, count in get_sync_redis().hgetall(_key(receiver_id)).items()}
+
+
+# Watermark of each message's receiver in its session (0 if they never read it)
+def _read_up_to():
+    from .models import ReadWatermark
+    watermark = ReadWatermark.objects.filter(
+        user_id=OuterRef('receiver_id'), session_id=OuterRef('session_id'),
+    ).values('last_read_message_id')[:1]
+    return Coalesce(Subquery(watermark), 0, output_field=BigIntegerField())
+
+
+# Messages still unread by their receiver, optionally only those received by one user
+def unread_messages(receiver_id=None):
+    from .models import Message
+    messages = Message.objects.all() if receiver_id is None else Message.objects.filter(receiver_id=receiver_id)
+    return messages.alias(read_up_to=_read_up_to()).filter(id__gt=F('read_up_to'))
+
+
+# Unread messages of one sender in a session (a range of message_session_id_idx past the watermark)
+def unread_in_session(receiver_id, session_pk, sender_id):
+    return unread_messages(receiver_id).filter(session_id=session_pk, sender_id=sender_id)
+
+
+# Messages already read by their receiver
+def read_messages():
+    from .models import Message
+    return Message.objects.alias(read_up_to=_read_up_to()).filter(id__lte=F('read_up_to'))
+
+
+# Move a user's watermark in a session up to message_id; never moves it back, so a late or out-of-order
+# read (another tab, a stale socket) cannot mark read messages unread again. The row is created if missing
+# (a no-op on conflict), then raised by a conditional UPDATE, which is safe against concurrent readers.
+async def set_watermark(user_id, session_pk, message_id):
+    from .models import ReadWatermark
+    await ReadWatermark.objects.abulk_create(
+        [ReadWatermark(user_id=user_id, session_id=session_pk, last_read_message_id=message_id)],
+        ignore_conflicts=True,
+    )
+    await ReadWatermark.objects.filter(
+        user_id=user_id, session_id=session_pk, last_read_message_id__lt=message_id,
+    ).aupdate(last_read_message_id=message_id, updated_at=timezone.now())
+
+
+# Replace every counter with the given {receiver_id: {sender_id: count}} mapping (sync)
+def replace_all(counts):
+    client = get_sync_redis()
+    stale = {key for key in client.scan_iter(match=f"{KEY_PREFIX}*", count=1000)}
+    with client.pipeline(transaction=False) as pipe:
+        for receiver_id, senders in counts.items():
+            key = _key(receiver_id)
+            stale.discard(key)
+            pipe.delete(key)
+            if senders:
+                pipe.hset(key, mapping=senders)
+        for key in stale:
+            pipe.delete(key)
+        pipe.execute()
@@ -9,4 +9,5 @@ urlpatterns = [
     path('get_messages/', views.get_messages, name='get_messages'),
     path('get_public_keys/', views.get_public_keys, name='get_public_keys'),
     path('get_session_id/', views.get_session_id, name='get_session_id'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,24 +1,29 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, Http404
 import json
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from .models import FriendRequest, Contact, Message, Session
+from . import archive, frames, metrics, unread
+from .cache import contact_cache, public_key_cache, session_key_cache, session_pair_key
+
+# Message history page sizes for get_messages
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
 
 
 # Chatroom views
 @login_required(login_url='/auth/login/')
 def chats(request):
-    friend_requests = FriendRequest.objects.filter(receiver=request.user)
-    contact_list = Contact.objects.filter(user=request.user)
+    # Built in a constant number of queries regardless of how many contacts the user has
+    friend_requests = FriendRequest.objects.filter(receiver=request.user).select_related('sender__profile')
+    contact_list = Contact.objects.filter(user=request.user).select_related('contact_user__profile')
+    unread_counts = get_unread_counts(request.user)
     for contact in contact_list:
-        contact.unread_count = Message.objects.filter(
-            sender=contact.contact_user, 
-            receiver=request.user, 
-            is_read=False
-        ).count()
+        contact.unread_count = unread_counts.get(str(contact.contact_user_id), 0)
     return render(
         request, 'chats.html', 
         {
@@ -29,6 +34,20 @@ def chats(request):
     )
 
 
+# Unread counts per sender from the Redis counters, or one grouped query if Redis is unavailable
+def get_unread_counts(user):
+    try:
+        return unread.get_counts(user.id)
+    except Exception:
+        rows = (
+            unread.unread_messages(user.id)
+            .values('sender_id')
+            .annotate(unread=Count('id'))
+            .order_by()
+        )
+        return {str(row['sender_id']): row['unread'] for row in rows}
+
+
 # Send friend request
 @login_required(login_url='/auth/login/')
 def send_friend_request(request):
@@ -67,11 +86,12 @@ def accept_friend_request(request):
         aes_key_encrypted_receiver = data.get('aes_key_encrypted_receiver')
         welcome_message_encrypted = data.get('encrypted_welcome_message')
         try:
-            user = User.objects.get(username=username)
+            user = User.objects.select_related('profile').get(username=username)
             contact = Contact(user=request.user, contact_user=user)
             contact.save()
             contact_reverse = Contact(user=user, contact_user=request.user)
             contact_reverse.save()
+            contact_cache.invalidate(request.user.id, user.id)
             FriendRequest.objects.filter(sender=user, receiver=request.user).delete()
 
             sender = request.user
@@ -84,6 +104,14 @@ def accept_friend_request(request):
                 aes_key_encrypted_sender=aes_key_encrypted_sender,
                 aes_key_encrypted_receiver=aes_key_encrypted_receiver
             )
+            # Both participants open this chat next, so warm the key lookup now
+            session_key_cache.set(session_pair_key(sender.username, receiver.username), {
+                'session_id': session.session_id,
+                'sender_username': sender.username,
+                'receiver_username': receiver.username,
+                'aes_key_encrypted_sender': session.aes_key_encrypted_sender,
+                'aes_key_encrypted_receiver': session.aes_key_encrypted_receiver,
+            })
             Message.objects.create(
                 session=session,
                 sender=sender,
@@ -91,6 +119,10 @@ def accept_friend_request(request):
                 content=welcome_message_encrypted,
                 nonce=nonce_b64,
             )
+            try:
+                unread.increment_sync(receiver.id, sender.id)
+            except Exception:
+                pass    # rebuilt by `manage.py rebuild_unread_counts`
             return JsonResponse({'success': True, 'message': 'Friend request accepted!'})
         except User.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'User not found.'})
@@ -111,58 +143,111 @@ def reject_friend_request(request):
             return JsonResponse({'success': False, 'error': 'Friend request not found.'})
 
 
-# Get messages between two users
+# Get messages between two users, one page at a time.
+# Returns the newest page first; pass the returned `next_before` as `before` to scroll back.
+# Messages inside a page are in chronological order.
 @login_required(login_url='/auth/login/')
 def get_messages(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         username = data.get('username')
         try:
-            contact = User.objects.get(username=username)
-            messages = Message.objects.filter(
+            before = int(data['before']) if data.get('before') else None
+            limit = max(1, min(int(data.get('limit') or HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False, 'error': 'Invalid cursor or limit.'})
+        try:
+            contact = User.objects.only('id', 'username').get(username=username)
+            # Go through the conversation's session so the page is a single range of message_session_id_idx
+            session_pk = Session.objects.filter(
                 Q(sender=request.user, receiver=contact) |
                 Q(sender=contact, receiver=request.user)
-            ).order_by('timestamp')
+            ).order_by('id').values_list('id', flat=True).first()
+            rows = list(history_page(session_pk, before)[:limit + 1])
+            # Older history continues in the archive once the hot table runs out (see archive.py)
+            if len(rows) <= limit and session_pk is not None:
+                rows += archive.read_archived(session_pk, rows[-1]['id'] if rows else before, limit + 1 - len(rows))
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            rows.reverse()
+            for row in rows:
+                row['content'], row['nonce'] = frames.row_text(row)
             messages_data = [
                 {
-                    'sender': msg.sender.username,
-                    'receiver': msg.receiver.username,
-                    'content': msg.content,
-                    'nonce': msg.nonce,
-                    'timestamp': timezone.localtime(msg.timestamp).strftime('%I:%M %p'),
-                    'is_sent': msg.sender == request.user
+                    'id': row['id'],
+                    'sender': request.user.username if row['sender_id'] == request.user.id else contact.username,
+                    'receiver': contact.username if row['sender_id'] == request.user.id else request.user.username,
+                    'content': row['content'],
+                    'nonce': row['nonce'],
+                    'timestamp': timezone.localtime(row['timestamp']).strftime('%I:%M %p'),
+                    'is_sent': row['sender_id'] == request.user.id
                 }
-                for msg in messages
+                for row in rows
             ]
-            if not messages_data:
+            if not messages_data and not before:
                 return JsonResponse({'success': False, 'error': 'No messages found.'})
-            return JsonResponse({'success': True, 'messages': messages_data})
+            return JsonResponse({
+                'success': True,
+                'messages': messages_data,
+                'has_more': has_more,
+                'next_before': messages_data[0]['id'] if messages_data else None,
+            })
         except User.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Contact not found.'})
     return JsonResponse({'success': False, 'error': 'Invalid request.'})
 
 
+# Messages of a session older than the `before` id (all if None), newest first
+def history_page(session_pk, before=None):
+    messages = Message.objects.filter(session_id=session_pk)
+    if before:
+        messages = messages.filter(id__lt=before)
+    return messages.order_by('-id').values(
+        'id', 'sender_id', 'content', 'nonce', 'content_bytes', 'nonce_bytes', 'timestamp'
+    )
+
+
+# Get a user's public key (cached, see cache.py); None if the user does not exist
+def get_public_key(username):
+    return public_key_cache.get(username, lambda: (
+        User.objects.filter(username=username).values_list('profile__public_key', flat=True).first()
+    ))
+
+
 # Get public keys for encryption
 @login_required(login_url='/auth/login/')
 def get_public_keys(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         username = data.get('username')
-        try:
-            user = User.objects.get(username=username)
-            print(f"Public key for {user.username}: {user.profile.public_key}")
-            print(f"Public key for {request.user.username}: {request.user.profile.public_key}")
-            return JsonResponse({
-                'success': True,
-                'public_key_sender': request.user.profile.public_key,
-                'public_key_receiver': user.profile.public_key
-            })
-        except User.DoesNotExist:
+        public_key_receiver = get_public_key(username) if username else None
+        if public_key_receiver is None:
             return JsonResponse({'success': False, 'error': 'User not found.'})
+        return JsonResponse({
+            'success': True,
+            'public_key_sender': get_public_key(request.user.username),
+            'public_key_receiver': public_key_receiver
+        })
     return JsonResponse({'success': False, 'error': 'Invalid request.'})
 
 
-# Get session ID for a chat
+# Load session id and encrypted AES keys of a conversation in one query, by its participants (the
+# "<sender>_<receiver>" session id is ambiguous when usernames contain '_')
+def load_session_keys(username_a, username_b):
+    return Session.objects.filter(
+        Q(sender__username=username_a, receiver__username=username_b) |
+        Q(sender__username=username_b, receiver__username=username_a)
+    ).order_by('id').values(
+        'session_id',
+        'aes_key_encrypted_sender',
+        'aes_key_encrypted_receiver',
+        sender_username=F('sender__username'),
+        receiver_username=F('receiver__username'),
+    ).first()
+
+
+# Get session ID, the caller's encrypted AES key and the peer's public key for a chat (cached, see cache.py;
+# the public key comes from its own cache entry, which saving the peer's profile invalidates)
 @login_required(login_url='/auth/login/')
 def get_session_id(request):
     if request.method == 'POST':
@@ -171,30 +256,39 @@ def get_session_id(request):
         receiver = data.get('receiver')
         if not sender or not receiver:
             return JsonResponse({'success': False, 'error': 'Missing sender or receiver.'})
-        
-        session_id = f"{sender}_{receiver}"
-        reverse_session_id = f"{receiver}_{sender}"
-        session_exists = Session.objects.filter(
-            Q(session_id=session_id) | Q(session_id=reverse_session_id)
-        ).exists()
-
-        if session_exists:
-            session = Session.objects.filter(Q(session_id=session_id) | Q(session_id=reverse_session_id)).first()
-            if session.sender == request.user:
-                aes_key = session.aes_key_encrypted_sender
-                r = session.receiver
+        # Only a participant of the conversation may read its keys
+        if request.user.username not in (sender, receiver):
+            return JsonResponse({'success': False, 'error': 'Invalid request.'})
+
+        keys = session_key_cache.get(
+            session_pair_key(sender, receiver), lambda: load_session_keys(sender, receiver)
+        )
+        # Checked against the session itself, not just the usernames in the request
+        if keys is not None and request.user.username in (keys['sender_username'], keys['receiver_username']):
+            if keys['sender_username'] == request.user.username:
+                aes_key, peer = keys['aes_key_encrypted_sender'], keys['receiver_username']
             else:
-                aes_key = session.aes_key_encrypted_receiver
-                r = session.sender
+                aes_key, peer = keys['aes_key_encrypted_receiver'], keys['sender_username']
             return JsonResponse({
                 'success': True,
-                'session_id': session.session_id,
+                'session_id': keys['session_id'],
                 'aes_key': aes_key,
-                'uname': r.username
+                'uname': peer,
+                'peer_public_key': get_public_key(peer),
             })
     return JsonResponse({'success': False, 'error': 'Invalid request.'})
 
 
+# Prometheus-style metrics of this worker (see metrics.py); staff or CHAT_METRICS ALLOWED_IPS only
+def metrics_view(request):
+    if not metrics.enabled():
+        raise Http404
+    allowed_ips = getattr(settings, 'CHAT_METRICS', {}).get('ALLOWED_IPS', [])
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # Uncomment if you want to implement sending messages via AJAX POST request
 # @login_required(login_url='/auth/login/')
 # def send_message(request):
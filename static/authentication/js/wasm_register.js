@@ -1,5 +1,12 @@
 import init, { aes_encrypt } from '/static/authentication/wasm/zcore_crypto.js';
 
+// URL of a WebAssembly bundle: the hashed, preloaded one from the page's <link rel="preload">
+// when present (so the preloaded response and its long-lived cache entry are reused)
+function wasmUrl(name, fallback) {
+    const link = document.querySelector(`link[rel="preload"][data-wasm="${name}"]`);
+    return link ? link.href : fallback;
+}
+
 document.addEventListener('DOMContentLoaded', function() {
     const form = document.getElementById('registerForm');
     form.addEventListener('submit', async function(e) {
@@ -39,7 +46,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const ivHex = Array.from(derivedBytes.slice(32)).map(b => b.toString(16).padStart(2, '0')).join('');
 
         // 5. Initialize Wasm
-        await init('/static/authentication/wasm/zcore_crypto_bg.wasm');
+        await init({ module_or_path: wasmUrl('zcore_crypto', '/static/authentication/wasm/zcore_crypto_bg.wasm') });
 
         // 6. Encrypt private key with Wasm AES
         const privateKeyBase64 = arrayBufferToBase64(privateKey);
@@ -8,11 +8,17 @@ import init, {
     generate_aes_key
 } from '/static/chatroom/wasm/chat_crypto_wasm.js';
 
+// Hashed, preloaded bundle URL from chats.html; init() falls back to the file next to chat_crypto_wasm.js
+function wasmUrl() {
+    const link = document.querySelector('link[rel="preload"][data-wasm="chat_crypto"]');
+    return link ? link.href : undefined;
+}
+
 // Ensure the WASM module is initialized only once
 let wasmInitialized = false;
 async function ensureWasm() {
     if (!wasmInitialized) {
-        await init(); // This loads and initializes the WASM module
+        await init({ module_or_path: wasmUrl() }); // This loads and initializes the WASM module
         wasmInitialized = true;
     }
 }
@@ -107,7 +113,7 @@ export async function getPublicKeys(username) {
 
 // Function to accept a friend request
 export async function acceptRequest(username) {
-    await init(); // Ensure WASM is initialized
+    await ensureWasm(); // Ensure WASM is initialized
     const aesKey = generate_aes_key();
     const nonce = generate_nonce();
     try {
@@ -2,6 +2,52 @@
 let chatSocket = null;
 let currentContactId = null;
 
+// Binary chat subprotocol (see chatroom/frames.py): chat messages carry raw ciphertext and nonce bytes
+// instead of base64 inside JSON. Offered on every chat socket; used only if the server accepts it.
+// Frame: u32 header length | JSON header | u8 nonce length | nonce | ciphertext
+const BINARY_SUBPROTOCOL = 'cindox.binary.v1';
+
+function base64ToBytes(b64) {
+    const binary = atob(b64);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+    return bytes;
+}
+
+function bytesToBase64(bytes) {
+    let binary = '';
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    }
+    return btoa(binary);
+}
+
+// Utility : function to build a binary frame from a header and base64 nonce/ciphertext
+function encodeBinaryFrame(header, nonceB64, ciphertextB64) {
+    const headerBytes = new TextEncoder().encode(JSON.stringify(header));
+    const nonce = base64ToBytes(nonceB64);
+    const ciphertext = base64ToBytes(ciphertextB64);
+    const frame = new Uint8Array(4 + headerBytes.length + 1 + nonce.length + ciphertext.length);
+    new DataView(frame.buffer).setUint32(0, headerBytes.length);
+    frame.set(headerBytes, 4);
+    frame[4 + headerBytes.length] = nonce.length;
+    frame.set(nonce, 5 + headerBytes.length);
+    frame.set(ciphertext, 5 + headerBytes.length + nonce.length);
+    return frame.buffer;
+}
+
+// Utility : function to turn a binary frame into the same object a JSON frame parses to
+function decodeBinaryFrame(buffer) {
+    const bytes = new Uint8Array(buffer);
+    const headerLength = new DataView(buffer).getUint32(0);
+    const data = JSON.parse(new TextDecoder().decode(bytes.subarray(4, 4 + headerLength)));
+    const nonceLength = bytes[4 + headerLength];
+    const nonceStart = 5 + headerLength;
+    data.nonce = bytesToBase64(bytes.subarray(nonceStart, nonceStart + nonceLength));
+    data.message = bytesToBase64(bytes.subarray(nonceStart + nonceLength));
+    return data;
+}
+
 // Helper function to format timestamp consistently
 function formatTimestamp(date = new Date()) {
     return date.toLocaleTimeString([], { 
@@ -93,6 +139,22 @@ function addMessageToUI(content, type, timestamp) {
     messageDiv.appendChild(messageBubble);
     messagesContainer.appendChild(messageDiv);
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    return messageDiv;
+}
+
+// Utility : function to flag a shown message that was never saved; clicking an own one sends it again
+function markMessageUnsent(messageDiv, text, type) {
+    messageDiv.classList.add('unsent');
+    if (type !== 'sent') {
+        messageDiv.querySelector('.message-time').textContent = 'Not delivered';
+        return;
+    }
+    messageDiv.querySelector('.message-time').textContent = 'Not delivered - click to resend';
+    messageDiv.addEventListener('click', () => {
+        messageDiv.remove();
+        document.getElementById('messageInput').value = text;
+        sendMessage();
+    }, { once: true });
 }
 
 // Main : function to remove a request item from the UI
@@ -174,21 +236,109 @@ async function decryptMessageForDisplay(encryptedContent, nonce, username) {
     }
 }
 
+// Message history paging state for the open chat
+let historyUsername = null;
+let historyBefore = null;
+let historyHasMore = false;
+let historyLoading = false;
+
+// Resume cursor of the open chat: newest message id seen, and every id already shown
+// (a replay after reconnecting may overlap frames that were already received)
+let lastSeenMessageId = null;
+let seenMessageIds = new Set();
+let chatReconnectDelay = 1000;
+// Plaintext of sent messages by nonce until they come back, so a rate-limited one can be restored
+const unsentMessages = new Map();
+// Messages shown before their write-behind batch committed (id null), by nonce, until
+// message_ack (own messages) or message_committed (the contact's) reports the result
+const pendingCommits = new Map();
+
+// Utility : function to mark the open conversation read and clear its badge
+function markCurrentContactRead() {
+    if (window.chatNotificationManager && window.chatNotificationManager.ws && window.chatNotificationManager.ws.readyState === WebSocket.OPEN) {
+        window.chatNotificationManager.ws.send(JSON.stringify({ type: 'mark_read', contact_id: currentContactId }));
+        // Also clear badge in UI immediately
+        window.chatNotificationManager.updateUnreadBadge(currentContactId, 0);
+    }
+}
+
+// Utility : function to apply the commit result of a message shown with id null
+function settleMessage(data) {
+    const pending = pendingCommits.get(data.nonce);
+    if (data.success) {
+        pendingCommits.delete(data.nonce);
+        trackMessageId(data.id);   // advances the resume cursor, so a replay skips it
+        // A received message was marked read before it committed, below its id: mark it read again
+        if (data.type === 'message_committed' && (!pending || pending.type === 'received')) {
+            markCurrentContactRead();
+        }
+    } else if (pending && pending.element) {
+        pendingCommits.delete(data.nonce);
+        markMessageUnsent(pending.element, pending.text, pending.type);
+    } else if (pending) {
+        pending.failed = true;  // the message is still being decrypted for display
+    }
+}
+
+// Utility : function to record a message id; returns false if it was already shown
+function trackMessageId(id) {
+    if (id === null || id === undefined) return true;  // not committed yet (write-behind)
+    if (seenMessageIds.has(id)) return false;
+    seenMessageIds.add(id);
+    if (lastSeenMessageId === null || id > lastSeenMessageId) lastSeenMessageId = id;
+    return true;
+}
+
+// Utility : function to build a message element from a history row
+async function buildHistoryMessage(msg, username) {
+    let decryptedContent = msg.content;
+    if (msg.nonce) {
+        decryptedContent = await decryptMessageForDisplay(msg.content, msg.nonce, username);
+    }
+    const msgDiv = document.createElement('div');
+    msgDiv.className = 'message ' + (msg.is_sent ? 'sent' : 'received');
+
+    // Create structure safely to prevent XSS
+    const messageBubble = document.createElement('div');
+    messageBubble.className = 'message-bubble';
+    messageBubble.textContent = decryptedContent;
+
+    const messageTime = document.createElement('div');
+    messageTime.className = 'message-time';
+    messageTime.textContent = msg.timestamp;
+    messageBubble.appendChild(messageTime);
+
+    msgDiv.appendChild(messageBubble);
+    return msgDiv;
+}
+
+// Utility : function to request one page of history (newest first, `before` scrolls back)
+async function requestMessagePage(username, before) {
+    const response = await fetch('/get_messages/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCSRFToken()
+        },
+        body: JSON.stringify({ username: username, before: before })
+    });
+    return await response.json();
+}
+
 // Main : function to fetch messages for selected contact
 async function fetchMessageForContact(username, setSessionId) {
     const messagesContainer = document.getElementById('messagesContainer');
     messagesContainer.innerHTML = '';  // Clear existing messages
+    historyUsername = username;
+    historyBefore = null;
+    historyHasMore = false;
+    lastSeenMessageId = null;
+    seenMessageIds = new Set();
+    pendingCommits.clear();
 
     try {
-        const response = await fetch('/get_messages/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': getCSRFToken()
-            },
-            body: JSON.stringify({ username: username })
-        });
-        const data = await response.json();
+        const data = await requestMessagePage(username, null);
+        if (historyUsername !== username) return;  // Another contact was selected meanwhile
 
         if (data.success) {
             if (data.messages.length > 0) {
@@ -196,26 +346,11 @@ async function fetchMessageForContact(username, setSessionId) {
                 await setSessionId(window.lastMessageObj);
             }
             for (let i = 0; i < data.messages.length; i++) {
-                let decryptedContent = data.messages[i].content;
-                if (data.messages[i].nonce) {
-                    decryptedContent = await decryptMessageForDisplay(data.messages[i].content, data.messages[i].nonce, username);
-                }
-                const msgDiv = document.createElement('div');
-                msgDiv.className = 'message ' + (data.messages[i].is_sent ? 'sent' : 'received');
-                
-                // Create structure safely to prevent XSS
-                const messageBubble = document.createElement('div');
-                messageBubble.className = 'message-bubble';
-                messageBubble.textContent = decryptedContent;
-                
-                const messageTime = document.createElement('div');
-                messageTime.className = 'message-time';
-                messageTime.textContent = data.messages[i].timestamp;
-                messageBubble.appendChild(messageTime);
-                
-                msgDiv.appendChild(messageBubble);
-                messagesContainer.appendChild(msgDiv);
+                trackMessageId(data.messages[i].id);
+                messagesContainer.appendChild(await buildHistoryMessage(data.messages[i], username));
             }
+            historyBefore = data.next_before;
+            historyHasMore = data.has_more;
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
         } else {
             messagesContainer.innerHTML = '<div class="no-messages">No messages found.</div>';
@@ -226,6 +361,39 @@ async function fetchMessageForContact(username, setSessionId) {
     }
 }
 
+// Main : function to load the previous page of history when scrolled to the top
+async function fetchOlderMessages() {
+    if (!historyHasMore || historyLoading || !historyUsername) return;
+    const username = historyUsername;
+    const messagesContainer = document.getElementById('messagesContainer');
+    historyLoading = true;
+    try {
+        const data = await requestMessagePage(username, historyBefore);
+        if (historyUsername !== username || !data.success) return;
+        const fragment = document.createDocumentFragment();
+        for (let i = 0; i < data.messages.length; i++) {
+            trackMessageId(data.messages[i].id);
+            fragment.appendChild(await buildHistoryMessage(data.messages[i], username));
+        }
+        // Keep the current view in place while prepending older messages
+        const previousHeight = messagesContainer.scrollHeight;
+        messagesContainer.insertBefore(fragment, messagesContainer.firstChild);
+        messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+        historyBefore = data.next_before;
+        historyHasMore = data.has_more;
+    } catch (error) {
+        console.error(error);
+    } finally {
+        historyLoading = false;
+    }
+}
+
+document.getElementById('messagesContainer').addEventListener('scroll', function () {
+    if (this.scrollTop === 0) {
+        fetchOlderMessages();
+    }
+});
+
 // Main : function to handle contact selection and update chat header
 document.querySelectorAll('.contact-item').forEach(contact => {
     contact.addEventListener('click', function () {
@@ -308,12 +476,17 @@ async function sendMessage() {
             const encryptedMessage = await module.encrypt_message_fun(aes_key_b64, message, nonce_b64);
 
             const timestamp = formatTimestamp();
-            chatSocket.send(JSON.stringify({
-                sessionName: sessionName,
-                message: encryptedMessage,
-                nonce: nonce_b64,
-                timestamp: timestamp
-            }));
+            unsentMessages.set(nonce_b64, message);
+            if (chatSocket.protocol === BINARY_SUBPROTOCOL) {
+                chatSocket.send(encodeBinaryFrame({}, nonce_b64, encryptedMessage));
+            } else {
+                chatSocket.send(JSON.stringify({
+                    sessionName: sessionName,
+                    message: encryptedMessage,
+                    nonce: nonce_b64,
+                    timestamp: timestamp
+                }));
+            }
 
             messageInput.value = '';
         } catch (error) {
@@ -326,7 +499,8 @@ async function sendMessage() {
 
 
 // Main : function to open a chat socket for a specific contact
-function openChatSocket(contactId) {
+// (resume: reconnecting after a drop, so only messages after lastSeenMessageId are replayed)
+function openChatSocket(contactId, resume = false) {
     // If a socket exists, close it and wait for it to close before opening a new one
     if (chatSocket) {
         chatSocket.onclose = null;
@@ -341,27 +515,66 @@ function openChatSocket(contactId) {
     // Delay opening new socket to ensure previous is closed
     setTimeout(() => {
         const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        const wsUrl = `${protocol}://${window.location.host}/ws/chat/${contactId}/`;
-        chatSocket = new WebSocket(wsUrl);
+        const cursor = resume && lastSeenMessageId !== null ? `?last_id=${lastSeenMessageId}` : '';
+        const wsUrl = `${protocol}://${window.location.host}/ws/chat/${contactId}/${cursor}`;
+        chatSocket = new WebSocket(wsUrl, [BINARY_SUBPROTOCOL]);
+        chatSocket.binaryType = 'arraybuffer';
+
+        chatSocket.onopen = function () {
+            chatReconnectDelay = 1000;
+        };
 
         chatSocket.onmessage = async function (event) {
-            const data = JSON.parse(event.data);
-            if (data.type === 'chat_message') {
+            const data = event.data instanceof ArrayBuffer ? decodeBinaryFrame(event.data) : JSON.parse(event.data);
+            if (data.type === 'message_ack' || data.type === 'message_committed') {
+                settleMessage(data);
+            } else if (data.type === 'resume_complete') {
+                // Too many messages were missed to replay; reload the history instead
+                if (data.has_more && historyUsername) {
+                    fetchMessageForContact(historyUsername, setSessionId);
+                }
+            } else if (data.type === 'rate_limited') {
+                // Dropped by the server: put the text back so it can be sent again
+                const text = unsentMessages.get(data.nonce);
+                unsentMessages.delete(data.nonce);
+                const messageInput = document.getElementById('messageInput');
+                if (text && !messageInput.value) messageInput.value = text;
+                console.warn(`Sending too fast, retry in ${data.retry_after_ms} ms`);
+            } else if (data.type === 'chat_message') {
+                if (!trackMessageId(data.id)) return;
                 const type = String(data.sender_id) === String(getCurrentUserId()) ? 'sent' : 'received';
+                if (type === 'sent') unsentMessages.delete(data.nonce);
+                // Write-behind message: registered before decrypting, its commit result may arrive meanwhile
+                const awaitingCommit = data.id === null;
+                if (awaitingCommit) pendingCommits.set(data.nonce, { type });
                 const username = document.getElementById('messageInput').name;
                 decryptedContent = await decryptMessageForDisplay(data.message, data.nonce, username);
-                addMessageToUI(decryptedContent, type, data.timestamp);
-                // If this chat is currently open and the message is received, mark as read immediately
-                if (type === 'received' && window.chatNotificationManager && window.chatNotificationManager.ws && window.chatNotificationManager.ws.readyState === WebSocket.OPEN) {
-                    window.chatNotificationManager.ws.send(JSON.stringify({ type: 'mark_read', contact_id: currentContactId }));
-                    // Also clear badge in UI immediately
-                    window.chatNotificationManager.updateUnreadBadge(currentContactId, 0);
+                const element = addMessageToUI(decryptedContent, type, data.timestamp);
+                const pending = awaitingCommit ? pendingCommits.get(data.nonce) : undefined;
+                if (pending) {
+                    pending.element = element;
+                    pending.text = decryptedContent;
+                    if (pending.failed) {
+                        pendingCommits.delete(data.nonce);
+                        markMessageUnsent(element, decryptedContent, type);
+                    }
                 }
+                // If this chat is currently open and the message is received, mark as read immediately
+                if (type === 'received') markCurrentContactRead();
             }
         };
 
-        chatSocket.onclose = function () {
+        // Reconnect with backoff after an unexpected drop, resuming from the last seen message
+        chatSocket.onclose = function (event) {
             chatSocket = null;
+            // Closed for flooding (4029): back off for longer before reconnecting
+            if (event.code === 4029) chatReconnectDelay = Math.max(chatReconnectDelay, 10000);
+            setTimeout(() => {
+                if (!chatSocket && currentContactId === contactId) {
+                    openChatSocket(contactId, true);
+                }
+            }, chatReconnectDelay);
+            chatReconnectDelay = Math.min(chatReconnectDelay * 2, 30000);
         };
     }, 150); // 150ms delay to allow socket to close
 }
@@ -16,16 +16,25 @@ class ChatNotificationManager {
 
         this.ws.onmessage = (event) => {
             const data = JSON.parse(event.data);
-            if (data.type === 'online_status') {
-                this.updateContactOnlineStatus(data.user_id, data.is_online);
-            } else if (data.type === 'unread_message') {
-                this.updateUnreadBadge(data.from_user, data.unread_count);
-            } else if (data.type === 'online_contacts') {
-                this.updateAllOnlineContacts(data.user_ids);
+            if (data.type === 'batch') {
+                // Notifications coalesced by the server into one frame, in arrival order
+                data.events.forEach(item => this.handleNotification(item));
+            } else {
+                this.handleNotification(data);
             }
         };
     }
 
+    handleNotification(data) {
+        if (data.type === 'online_status') {
+            this.updateContactOnlineStatus(data.user_id, data.is_online);
+        } else if (data.type === 'unread_message') {
+            this.updateUnreadBadge(data.from_user, data.unread_count);
+        } else if (data.type === 'online_contacts') {
+            this.updateAllOnlineContacts(data.user_ids);
+        }
+    }
+
     updateAllOnlineContacts(userIds) {
         // Set all contacts offline first
         document.querySelectorAll('.contact-item').forEach(contact => {
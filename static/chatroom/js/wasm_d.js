@@ -1,5 +1,12 @@
 import init, { aes_decrypt } from '/static/authentication/wasm/zcore_crypto.js';
 
+// URL of a WebAssembly bundle: the hashed, preloaded one from the page's <link rel="preload">
+// when present (so the preloaded response and its long-lived cache entry are reused)
+function wasmUrl(name, fallback) {
+    const link = document.querySelector(`link[rel="preload"][data-wasm="${name}"]`);
+    return link ? link.href : fallback;
+}
+
 let userPassword = null;
 
 // Function to open IndexedDB for temporary key storage
@@ -115,7 +122,7 @@ async function getDecryptedPrivateKey() {
     }
 
     try {
-        await init('/static/authentication/wasm/zcore_crypto_bg.wasm');
+        await init({ module_or_path: wasmUrl('zcore_crypto', '/static/authentication/wasm/zcore_crypto_bg.wasm') });
 
         const db = await openUserKeysDB();
         const result = await getFromStore(db, "keys", "privateKey");
@@ -14,6 +14,7 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 import chatroom.routing
+from chatroom.lifespan import install_daphne_shutdown_hook, lifespan_app
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zcore.settings')
 django.setup()
@@ -25,4 +26,7 @@ application = ProtocolTypeRouter({
             chatroom.routing.websocket_urlpatterns
         )
     ),
+    "lifespan": lifespan_app,
 })
+
+install_daphne_shutdown_hook()